@@ -0,0 +1,309 @@
+"""Page aggregations as pure functions, memoized by filter state.
+
+Every function takes its data source (the aggregate cube or a
+``RowSelection`` of filtered rows) plus the sidebar selection and returns a
+small frame or dict. ``SalesEngine`` caches the results in ``results`` under
+a ``cache_key`` of the function name, the data version and a canonical form
+of the selection, so flipping between pages with unchanged filters is served
+from memory. Cached results are shared: callers must not modify them in
+place.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+class LRUCache:
+    """Thread-safe LRU mapping with hit/miss counters.
+
+    Entries are evicted once there are more than ``maxsize`` of them or, when
+    ``maxbytes`` is set, once the summed ``sizeof(value)`` exceeds it.
+    """
+
+    def __init__(self, maxsize=256, maxbytes=None, sizeof=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            if key in self._data:
+                self._discard(key)
+            self._data[key] = value
+            if self.sizeof is not None:
+                self.nbytes += self.sizeof(value)
+            while self._data and self._over_limit():
+                self._discard(next(iter(self._data)))
+        return value
+
+    def _over_limit(self):
+        if self.maxsize is not None and len(self._data) > self.maxsize:
+            return True
+        return self.maxbytes is not None and self.nbytes > self.maxbytes
+
+    def _discard(self, key):
+        value = self._data.pop(key)
+        if self.sizeof is not None:
+            self.nbytes -= self.sizeof(value)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'nbytes': self.nbytes,
+            'maxbytes': self.maxbytes,
+        }
+
+
+results = LRUCache(maxsize=256)
+
+# Row positions of filter selections (4 bytes per selected row) are bounded by size, not count
+POSITIONS_CACHE_BYTES = int(os.environ.get('DASHBOARD_POSITIONS_CACHE_MB', 256)) * 2**20
+
+
+def positions_nbytes(rows):
+    return 0 if rows is None else rows.nbytes
+
+
+positions = LRUCache(maxsize=None, maxbytes=POSITIONS_CACHE_BYTES, sizeof=positions_nbytes)
+
+# Up to this many rows the customer count is exact; above it the cube's sketches answer it
+EXACT_DISTINCT_ROWS = int(os.environ.get('DASHBOARD_EXACT_DISTINCT_ROWS', 100_000))
+
+# Buckets an automatically grained trend line may have at most
+TREND_MAX_POINTS = 400
+
+# Product lines beyond this many are collapsed into one "Other" heatmap row
+HEATMAP_MAX_ROWS = 30
+
+
+def canonical_selection(selection, domains=None):
+    """Hashable, order-independent form of a sidebar selection.
+
+    Columns whose selection covers their whole domain collapse to ``'*'`` so
+    that the default all-selected state has a single key.
+    """
+    items = []
+    for col in sorted(selection):
+        values = set(selection[col])
+        if domains is not None and col in domains and values >= set(domains[col]):
+            items.append((col, '*'))
+        else:
+            items.append((col, tuple(sorted(values, key=str))))
+    return tuple(items)
+
+
+def cache_key(name, version, selection, args=(), domains=None):
+    """Key for a result derived from (data version, selection) and ``args``.
+
+    Sources such as the cube or a filtered frame are determined by
+    ``version`` and ``selection`` and are left out of the key; only the
+    scalar/tuple arguments (e.g. a grouping column) are part of it.
+    """
+    params = tuple(arg for arg in args if arg is None or isinstance(arg, (str, int, float, tuple)))
+    return name, version, canonical_selection(selection, domains), params
+
+
+def kpis(cube, selection):
+    totals = cube.query(selection)
+    return {
+        'total_profit': totals['gross income'].round(0),
+        'total_cogs': totals['cogs'],
+        'invoices': int(totals['count']),
+    }
+
+
+def customer_count(rows):
+    return rows['Invoice ID'].nunique()
+
+
+def approx_customer_count(cube, selection):
+    """Distinct Invoice IDs estimated by merging the cube's HyperLogLog sketches."""
+    return int(round(cube.distinct_invoices(selection)))
+
+
+def product_line_summary(cube, selection):
+    cells = cube.query(selection, ['Product line'])
+    return pd.DataFrame({
+        'Total_Revenue': cells['Total'],
+        'Average_Quantity': cells['Quantity'] / cells['count'],
+        'Average_Unit_Price': cells['Unit price'] / cells['count'],
+    }).sort_values(by='Total_Revenue', ascending=False)
+
+
+def branch_city_revenue(cube, selection):
+    return cube.query(selection, ['Branch', 'City'])['Total'].rename('Total_Revenue').reset_index()
+
+
+def customer_type_gender_counts(cube, selection):
+    return cube.query(selection, ['Customer type', 'Gender'])['count'].rename('Count').reset_index()
+
+
+def trend_granularity(first_day, last_day, max_points=TREND_MAX_POINTS):
+    """Finest of day/week/month keeping the day keys ``first_day..last_day`` within ``max_points`` buckets."""
+    days = last_day - first_day + 1
+    if days <= max_points:
+        return 'day'
+    if days // 7 + 2 <= max_points:
+        return 'week'
+    return 'month'
+
+
+def bucket_dates(keys, granularity):
+    """Timestamps of integer cube time keys: bucket start days, or month ends for months."""
+    keys = np.asarray(keys, dtype=np.int64)
+    if granularity == 'month':
+        return pd.to_datetime(keys.astype('datetime64[M]')) + pd.offsets.MonthEnd(0)
+    return pd.to_datetime(keys.astype('datetime64[D]'))
+
+
+def sales_trend(cube, selection, granularity='auto', max_points=TREND_MAX_POINTS):
+    """Total per day, week or month, from the cube's precomputed rollups.
+
+    ``'auto'`` picks the granularity from the date range the selection spans
+    (read off the small month table) so that at most ``max_points`` buckets
+    are plotted. Returns the chosen granularity and a Date/Total frame.
+    """
+    if granularity == 'auto':
+        months = cube.query(selection, ['month']).index.to_numpy(dtype=np.int64)
+        granularity = 'day'
+        if len(months):
+            first_day, end_day = (
+                np.array([months.min(), months.max() + 1], dtype='datetime64[M]')
+                .astype('datetime64[D]').astype(np.int64)
+            )
+            granularity = trend_granularity(first_day, end_day - 1, max_points)
+    totals = cube.query(selection, [granularity])['Total']
+    return {
+        'granularity': granularity,
+        'data': pd.DataFrame({'Date': bucket_dates(totals.index, granularity), 'Total': totals.to_numpy()}),
+    }
+
+
+def hourly_sales(cube, selection):
+    return cube.query(selection, ['hour'])['Total'].rename_axis('Hour').reset_index()
+
+
+def sales_by(cube, selection, column):
+    return cube.query(selection, [column])['Total'].reset_index()
+
+
+def purchase_counts(cube, selection, column):
+    return cube.query(selection, ['Product line', column])['count'].rename('Count').reset_index()
+
+
+def collapse_top(values, level, n, other='Other'):
+    """Sum the ``level`` labels of ``values`` outside the top ``n - 1`` by total into ``other``.
+
+    ``values`` is a Series indexed by the non-empty cells only, so this scales
+    with the number of cells rather than with the dense pivot.
+    """
+    totals = values.groupby(level=level, observed=True, sort=False).sum()
+    if n is None or len(totals) <= n:
+        return values
+    keep = set(totals.nlargest(n - 1).index)
+    frame = values.reset_index()
+    labels = frame[level].astype(object)
+    frame[level] = pd.Categorical(
+        labels.where(labels.isin(keep), other),
+        categories=[label for label in totals.index if label in keep] + [other],
+    )
+    return frame.groupby(list(values.index.names), observed=True)[values.name].sum()
+
+
+def product_city_sales(cube, selection, max_rows=HEATMAP_MAX_ROWS):
+    """Product line x City revenue pivot, densified only after top-N collapsing."""
+    cells = cube.query(selection, ['Product line', 'City'])['Total']
+    return collapse_top(cells, 'Product line', max_rows).unstack('City', fill_value=0)
+
+
+def stratified_sample(rows, size, seed=42):
+    """At most ~``size`` of the ``RowSelection`` ``rows``, sampled evenly from every Product line/Gender group."""
+    if len(rows) <= size:
+        return rows.frame()
+    frac = size / len(rows)
+    groups = rows.frame(['Product line', 'Gender']).reset_index(drop=True)
+    picked = groups.groupby(['Product line', 'Gender'], observed=True).sample(frac=frac, random_state=seed).index
+    # Only the sampled rows are gathered in full
+    return rows.subset(picked.to_numpy()).frame()
+
+
+def rating_total_density(rows, bins=40):
+    """Rating x Total 2D histogram per Product line, on bin edges shared by all facets."""
+    rating = rows['Rating'].to_numpy()
+    total = rows['Total'].to_numpy()
+    if not len(rating):
+        # No rows to place bin edges around
+        return {'rating': np.empty(0), 'total': np.empty(0), 'counts': {}}
+    rating_edges = np.linspace(rating.min(), rating.max(), bins + 1)
+    total_edges = np.linspace(total.min(), total.max(), bins + 1)
+    product_lines = rows['Product line'].reset_index(drop=True)
+    counts = {}
+    for product_line, idx in product_lines.groupby(product_lines, observed=True).indices.items():
+        counts[product_line], _, _ = np.histogram2d(rating[idx], total[idx], bins=[rating_edges, total_edges])
+    return {
+        'rating': (rating_edges[:-1] + rating_edges[1:]) / 2,
+        'total': (total_edges[:-1] + total_edges[1:]) / 2,
+        'counts': counts,
+    }
+
+
+def weighted_quantiles(values, counts, probs):
+    """Quantiles of sorted ``values`` repeated ``counts`` times (numpy's linear method)."""
+    cumulative = np.cumsum(counts)
+    n = cumulative[-1]
+    result = []
+    for prob in probs:
+        position = (n - 1) * prob
+        below = int(np.floor(position))
+        low = values[np.searchsorted(cumulative, below, side='right')]
+        high = values[np.searchsorted(cumulative, min(below + 1, n - 1), side='right')]
+        result.append(low + (position - below) * (high - low))
+    return result
+
+
+QUARTILE_COLUMNS = ['q1', 'median', 'q3', 'lowerfence', 'upperfence']
+
+
+def rating_quartiles(cube, selection, column):
+    """Box plot statistics of Rating per ``column`` value (Tukey 1.5 IQR whiskers).
+
+    Computed from the cube's rating distributions, so no raw rows are sorted.
+    """
+    distribution = cube.query(selection, [column, 'rating_bin'])['count']
+    stats = {}
+    for key, counts in distribution.groupby(level=column, observed=True):
+        values = counts.index.get_level_values('rating_bin').to_numpy()
+        q1, median, q3 = weighted_quantiles(values, counts.to_numpy(), [0.25, 0.5, 0.75])
+        iqr = q3 - q1
+        inside = values[(values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)]
+        stats[key] = [q1, median, q3, inside.min(), inside.max()]
+    # Keeps the columns when nothing matches, so the box plot renders empty
+    return pd.DataFrame.from_dict(stats, orient='index', columns=QUARTILE_COLUMNS).rename_axis(column)
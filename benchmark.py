@@ -0,0 +1,393 @@
+"""Latency and memory benchmark of the dashboard aggregations.
+
+Synthetic supermarket sales are generated at each requested size and loaded
+into a ``SalesEngine``; every aggregation and every page is then timed cold
+(result cache cleared) for the default "everything selected" filter state and
+for a narrower selection, and its peak traced memory is recorded.
+
+Run ``python benchmark.py [--sizes 1000 100000 10000000] [--json out.json]``;
+``--compare baseline.json`` exits non-zero when a measurement regressed by
+more than ``--tolerance`` against an earlier ``--json`` run. ``--export
+out.csv`` instead writes the first size as a CSV in the export's format, e.g.
+to measure ingestion scaling with ``python streaming.py out.csv --workers 1 2 4``.
+``--compact`` benchmarks frames in the compact layout, and ``--memory-report``
+prints per-column memory of the full and compact layouts at each size.
+``--sessions 1 10 50`` load-tests that many concurrent simulated sessions
+sharing one engine and reports page latency and RSS growth per session.
+``--backend duckdb`` benchmarks the DuckDB backend over an exported CSV of
+each size (its parity with the pandas engine is checked by
+``tests/test_sql_backend.py``).
+``--partitions DIR`` writes the first size as ``branch=X/month=YYYY-MM``
+partition files under DIR, loads it cold and compares the pages of every
+partition with those of engines pruned to one branch and to one month.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows: no RSS in the load test
+    resource = None
+
+from aggregations import LRUCache
+from data_loader import DATE_FORMAT, compact_frame
+from engine import PAGE_AGGREGATIONS, PAGES, SalesEngine
+
+DEFAULT_SIZES = [1_000, 100_000]
+
+BRANCH_CITIES = {'A': 'Yangon', 'B': 'Mandalay', 'C': 'Naypyitaw'}
+PRODUCT_LINES = [
+    'Electronic accessories', 'Fashion accessories', 'Food and beverages',
+    'Health and beauty', 'Home and lifestyle', 'Sports and travel',
+]
+PAYMENTS = ['Cash', 'Credit card', 'Ewallet']
+
+# Aggregations timed on their own, with their extra arguments
+AGGREGATIONS = [
+    ('kpis',), ('customer_count', True), ('customer_count', False), ('product_line_summary',), ('branch_city_revenue',),
+    ('customer_type_gender_counts',), ('sales_trend',), ('sales_trend', 'month'), ('hourly_sales',),
+    ('sales_by', 'Gender'), ('sales_by', 'Product line'), ('sales_by', 'Branch'), ('sales_by', 'Payment'),
+    ('purchase_counts', 'Gender'), ('purchase_counts', 'Customer type'), ('product_city_sales',),
+    ('rating_quartiles', 'Product line'), ('rating_quartiles', 'Payment'),
+    ('scatter_sample', 10_000), ('rating_density',),
+]
+
+
+def invoice_ids(rows):
+    """Unique ``ddd-dd-dddd`` Invoice IDs, formatted with array ops rather than per row."""
+    # An odd multiplier not divisible by 5 permutes 0..10**9-1, so IDs are unique
+    numbers = (np.arange(rows, dtype=np.int64) * 7919 + 12345) % 10**9
+    chars = np.full((rows, 11), ord('-'), dtype=np.uint8)
+    positions = [0, 1, 2, 4, 5, 7, 8, 9, 10]
+    for place, pos in enumerate(positions):
+        chars[:, pos] = ord('0') + numbers // 10**(len(positions) - 1 - place) % 10
+    return chars.view('S11').ravel().astype(str).astype(object)
+
+
+def categorical(rng, values, rows):
+    return pd.Categorical.from_codes(rng.integers(0, len(values), rows), categories=values)
+
+
+def synthetic_sales(rows, seed=0):
+    """Frame shaped like the parsed export (``read_sales_csv``) with ``rows`` random sales."""
+    rng = np.random.default_rng(seed)
+    branch_codes = rng.integers(0, len(BRANCH_CITIES), rows)
+    unit_price = rng.uniform(10, 100, rows).round(2)
+    quantity = rng.integers(1, 11, rows)
+    cogs = (unit_price * quantity).round(2)
+    tax = cogs * 0.05
+    times = [f'{minute // 60:02d}:{minute % 60:02d}' for minute in range(10 * 60, 21 * 60)]
+    # Keys in the export's column order (data_loader.COLUMNS)
+    df = pd.DataFrame({
+        'Invoice ID': invoice_ids(rows),
+        'Branch': pd.Categorical.from_codes(branch_codes, categories=list(BRANCH_CITIES)),
+        'City': pd.Categorical.from_codes(branch_codes, categories=list(BRANCH_CITIES.values())),
+        'Customer type': categorical(rng, ['Member', 'Normal'], rows),
+        'Gender': categorical(rng, ['Female', 'Male'], rows),
+        'Product line': categorical(rng, PRODUCT_LINES, rows),
+        'Unit price': unit_price,
+        'Quantity': quantity,
+        'Tax 5%': tax,
+        'Total': cogs + tax,
+        'Date': pd.Timestamp('2019-01-01') + pd.to_timedelta(rng.integers(0, 90, rows), unit='D'),
+        'Time': np.asarray(times, dtype=object)[rng.integers(0, len(times), rows)],
+        'Payment': categorical(rng, PAYMENTS, rows),
+        'cogs': cogs,
+        'gross margin percentage': 4.761904762,
+        'gross income': tax,
+        'Rating': rng.uniform(4, 10, rows).round(1),
+    })
+    # The export's City categories are sorted like every other category column
+    df['City'] = df['City'].cat.reorder_categories(sorted(BRANCH_CITIES.values()))
+    return df
+
+
+def write_export(df, path, chunksize=1_000_000):
+    """Write ``df`` as a CSV formatted like the original export."""
+    for start in range(0, len(df), chunksize):
+        chunk = df.iloc[start:start + chunksize].copy()
+        chunk['Date'] = chunk['Date'].dt.strftime(DATE_FORMAT)
+        chunk.to_csv(path, index=False, header=start == 0, mode='w' if start == 0 else 'a')
+
+
+def write_partitions(df, root):
+    """Write ``df`` as one CSV per branch and month under ``root``, e.g. ``branch=A/month=2019-01/sales.csv``."""
+    months = df['Date'].dt.strftime('%Y-%m')
+    for (branch, month), part in df.groupby([df['Branch'], months], observed=True):
+        folder = os.path.join(root, f'branch={branch}', f'month={month}')
+        os.makedirs(folder, exist_ok=True)
+        write_export(part, os.path.join(folder, 'sales.csv'))
+
+
+def partition_report(root):
+    """Cold ``SalesEngine.load`` of the partitioned ``root``, then the pages of pruned engines.
+
+    As in the dashboard, each filter state runs the Overview and Research
+    Question 5 pages (the ones reading rows) on ``engine.pruned(...)`` with
+    the partitions' cubes warm from the load; reports time, partitions read
+    and the rows held in memory for them.
+    """
+    import cube
+    import data_loader
+    import partitions
+    import aggregations as agg
+
+    data_loader._frames.clear()
+    cube._cubes.clear()
+    partitions.cubes.clear()
+    partitions.rows.clear()
+    start = time.perf_counter()
+    engine = SalesEngine.load(root)
+    catalog = engine.catalog
+    report = {'load': {
+        'ms': round((time.perf_counter() - start) * 1000, 3),
+        'partitions': len(catalog.partitions),
+        'rows': engine.row_count,
+        'rows_mib': partitions.rows.nbytes / 2**20,
+    }}
+    first, _ = catalog.date_range
+    first_month = (first, (pd.Timestamp(first) + pd.offsets.MonthEnd(0)).date())
+    loads = {
+        'all': (engine.default_selection(), None),
+        'one branch': ({**engine.default_selection(), 'Branch': catalog.domains['Branch'][:1]}, None),
+        'one month': (engine.default_selection(), first_month),
+    }
+    for label, (selection, dates) in loads.items():
+        for memo in (partitions.cubes, partitions.rows, agg.results, agg.positions):
+            memo.clear()
+        start = time.perf_counter()
+        pruned = engine.pruned(selection, dates)
+        for page in ("Overview", "Research Question 5"):
+            pruned.page(page, selection)
+        report[label] = {
+            'ms': round((time.perf_counter() - start) * 1000, 3),
+            'partitions': len(catalog.prune(selection, dates)),
+            'rows': pruned.row_count,
+            'rows_mib': partitions.rows.nbytes / 2**20,
+        }
+    return report
+
+
+def measure(func, repeat):
+    """Best wall time over ``repeat`` runs, then one traced run for peak memory."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'ms': round(best * 1000, 3), 'peak_bytes': peak}
+
+
+def memory_report(df):
+    """Deep memory per column of ``df`` in the full and the compact layout."""
+    full = df.memory_usage(index=False, deep=True)
+    compact = compact_frame(df).memory_usage(index=False, deep=True)
+    report = pd.DataFrame({'full': full, 'compact': compact}).reindex(full.index).fillna(0).astype(np.int64)
+    report.loc['total'] = report.sum()
+    report['saved'] = 1 - report['compact'] / report['full']
+    return report
+
+
+def run(sizes, repeat=3, compact=False, backend='pandas'):
+    results = {}
+    for rows in sizes:
+        df = synthetic_sales(rows)
+        if compact:
+            df = compact_frame(df)
+        cache = LRUCache(maxsize=None)
+        positions = LRUCache(maxsize=None)
+        holder = {}
+        if backend == 'duckdb':
+            # The database is built from a CSV export, as the dashboard builds it
+            folder = tempfile.mkdtemp(prefix='benchmark-')
+            path = os.path.join(folder, f'sales-{rows}.csv')
+            write_export(df, path)
+
+        def build():
+            if backend == 'duckdb':
+                holder['engine'] = SalesEngine.from_sql(path, cache=cache)
+            else:
+                holder['engine'] = SalesEngine.from_frame(
+                    df, version=f'synthetic-{rows}', cache=cache, positions=positions
+                )
+
+        results[f'{rows}/build/engine'] = measure(build, 1)
+        engine = holder['engine']
+        selections = {
+            'all': engine.default_selection(),
+            'subset': {**engine.default_selection(), 'Branch': ['A', 'B'], 'Gender': ['Female']},
+        }
+        for label, selection in selections.items():
+            def cold(call):
+                def func():
+                    # Cold: every call recomputes instead of hitting the result caches
+                    cache.clear()
+                    positions.clear()
+                    call()
+                return func
+
+            for spec in AGGREGATIONS:
+                name = '.'.join(str(part) for part in spec)
+                method = getattr(engine, spec[0])
+                results[f'{rows}/{label}/aggregation/{name}'] = measure(
+                    cold(lambda: method(selection, *spec[1:])), repeat
+                )
+            for page in PAGE_AGGREGATIONS:
+                results[f'{rows}/{label}/page/{page}'] = measure(cold(lambda: engine.page(page, selection)), repeat)
+    return results
+
+
+def current_rss():
+    """Resident set size of this process in bytes (the peak where /proc is unavailable, None on Windows)."""
+    try:
+        with open('/proc/self/statm') as handle:
+            return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return None if resource is None else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def load_test(rows, sessions, reruns=20, seed=0):
+    """Page latency and RSS (None where unavailable) with ``sessions`` concurrent sessions sharing one engine.
+
+    Each session is a thread, as in Streamlit, rerunning random pages with
+    random filter selections while a sampler records the peak RSS.
+    """
+    engine = SalesEngine.from_frame(synthetic_sales(rows), version=f'synthetic-{rows}', cache=LRUCache(maxsize=256))
+    baseline = current_rss()
+    latencies = []
+    peak = [baseline]
+    done = threading.Event()
+
+    def sample_rss():
+        while baseline is not None and not done.wait(0.01):
+            peak[0] = max(peak[0], current_rss())
+
+    def session(number):
+        rng = np.random.default_rng([seed, number])
+        for _ in range(reruns):
+            selection = {
+                col: [value for value in values if rng.random() < 0.7] or values[:1]
+                for col, values in engine.domains.items()
+            }
+            page = PAGES[rng.integers(len(PAGES))]
+            start = time.perf_counter()
+            engine.page(page, selection)
+            latencies.append(time.perf_counter() - start)
+
+    sampler = threading.Thread(target=sample_rss)
+    sampler.start()
+    threads = [threading.Thread(target=session, args=(number,)) for number in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    done.set()
+    sampler.join()
+    if baseline is not None:
+        peak[0] = max(peak[0], current_rss())
+    p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+    return {
+        'sessions': sessions,
+        'p50_ms': round(p50, 3),
+        'p95_ms': round(p95, 3),
+        'rss_base_bytes': baseline,
+        'rss_peak_bytes': peak[0],
+        'rss_per_session_bytes': None if baseline is None else (peak[0] - baseline) // sessions,
+    }
+
+
+def compare(results, baseline, tolerance, min_ms):
+    """Measurements slower or larger than ``baseline`` by more than ``tolerance``."""
+    regressions = []
+    for key, current in results.items():
+        before = baseline.get(key)
+        if before is None:
+            continue
+        # Sub-millisecond timings are mostly noise
+        if current['ms'] > max(before['ms'], min_ms) * (1 + tolerance):
+            regressions.append(f"{key}: {before['ms']:.3f} ms -> {current['ms']:.3f} ms")
+        if current['peak_bytes'] > before['peak_bytes'] * (1 + tolerance) + 2**16:
+            regressions.append(f"{key}: peak {before['peak_bytes']:,} B -> {current['peak_bytes']:,} B")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='write the measurements to this file')
+    parser.add_argument('--compare', help='earlier --json output to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed relative slowdown (0.5 = +50%%)')
+    parser.add_argument('--min-ms', type=float, default=1.0, help='ignore timings below this many milliseconds')
+    parser.add_argument('--export', help='write synthetic sales of the first size to this CSV and exit')
+    parser.add_argument('--compact', action='store_true', help='benchmark frames in the compact layout')
+    parser.add_argument('--memory-report', action='store_true',
+                        help='compare the memory of the full and compact layouts and exit')
+    parser.add_argument('--sessions', type=int, nargs='+',
+                        help='load-test these numbers of concurrent sessions on the first size and exit')
+    parser.add_argument('--backend', choices=['pandas', 'duckdb'], default='pandas',
+                        help='engine backend to benchmark')
+    parser.add_argument('--partitions', help='write the first size partitioned into this folder, compare pruned pages and exit')
+    args = parser.parse_args()
+
+    if args.partitions:
+        write_partitions(synthetic_sales(args.sizes[0]), args.partitions)
+        for label, report in partition_report(args.partitions).items():
+            print(f"{label:<12} {report['ms']:>10.3f} ms  {report['partitions']:>4} partitions  {report['rows']:>10,} rows  "
+                  f"{report['rows_mib']:>8.1f} MiB of rows held")
+        return
+
+    if args.sessions:
+        for sessions in args.sessions:
+            report = load_test(args.sizes[0], sessions)
+            rss = 'RSS n/a' if report['rss_base_bytes'] is None else (
+                f"RSS {report['rss_base_bytes'] / 2**20:,.1f} -> {report['rss_peak_bytes'] / 2**20:,.1f} MiB  "
+                f"(+{report['rss_per_session_bytes'] / 2**20:,.2f} MiB per session)"
+            )
+            print(f"{sessions:>4} sessions  p50 {report['p50_ms']:>9.3f} ms  p95 {report['p95_ms']:>9.3f} ms  {rss}")
+        return
+
+    if args.memory_report:
+        for rows in args.sizes:
+            report = memory_report(synthetic_sales(rows))
+            print(f'{rows:,} rows')
+            print(report.to_string(formatters={'saved': '{:.0%}'.format}))
+        return
+
+    if args.export:
+        write_export(synthetic_sales(args.sizes[0]), args.export)
+        return
+
+    results = run(args.sizes, args.repeat, args.compact, args.backend)
+    width = max(len(key) for key in results)
+    for key, value in results.items():
+        print(f"{key:<{width}}  {value['ms']:>10.3f} ms  {value['peak_bytes'] / 2**20:>9.2f} MiB")
+    if args.json:
+        with open(args.json, 'w') as handle:
+            json.dump(results, handle, indent=2)
+    if args.compare:
+        with open(args.compare) as handle:
+            regressions = compare(results, json.load(handle), args.tolerance, args.min_ms)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""Pre-aggregated cube over the sidebar filter dimensions.
+
+Each table of the cube holds additive measures for every observed
+combination of the four filter columns and the extra grouping dimensions
+of that table. A filter selection is answered by masking and summing the
+(few) cube cells instead of rescanning the raw rows. Because all measures
+are sums, cubes built from separate chunks of the data can be merged.
+Each cell of the filter-columns-only table also carries a HyperLogLog
+sketch of its Invoice IDs, merged the same way, for distinct counts.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from data_loader import (
+    DATA_PATH, FILTER_COLUMNS, appended_since, data_version, invoice_hashes, load_sales, sales_column,
+)
+from sketches import hll_estimate, hll_merge, hll_registers
+
+MEASURES = ['Total', 'cogs', 'gross income', 'Quantity', 'Rating', 'Unit price']
+# Export columns ``build_cube`` reads
+CUBE_COLUMNS = FILTER_COLUMNS + ['Invoice ID', 'Product line', 'Payment', 'Date', 'Time'] + MEASURES
+
+# Extra grouping dimensions of each cube table (() = filter columns only).
+# ``rating_bin`` is Rating rounded to its recorded 0.1 precision, so those
+# tables hold the rating distributions used by the box plots. The time
+# dimensions are integer keys (see ``time_keys``).
+GROUPINGS = [
+    (),
+    ('Product line',),
+    ('Payment',),
+    ('day',),
+    ('week',),
+    ('month',),
+    ('hour',),
+    ('Product line', 'rating_bin'),
+    ('Payment', 'rating_bin'),
+]
+
+
+def time_keys(df):
+    """Integer keys of the ``day``/``week``/``month``/``hour`` groupings.
+
+    ``day`` counts days since 1970-01-01, ``week`` is the day key of the
+    week's Monday, ``month`` counts months since January 1970 and ``hour``
+    is the hour of day taken from the ``HH:MM`` Time column.
+    """
+    day = df['Date'].to_numpy().astype('datetime64[D]').astype(np.int32)
+    month = df['Date'].to_numpy().astype('datetime64[M]').astype(np.int32)
+    # 1970-01-01 was a Thursday, i.e. three days after a Monday
+    week = day - (day + 3) % 7
+    if 'Time' in df:
+        hour = df['Time'].str.slice(0, 2).astype(np.int8).to_numpy()
+    else:
+        # Compact frames carry the time of day in Date
+        hour = df['Date'].dt.hour.astype(np.int8).to_numpy()
+    return {'day': day, 'week': week, 'month': month, 'hour': hour}
+
+
+class SalesCube:
+    def __init__(self, tables, version=None, invoice_sketches=None):
+        self.tables = tables
+        self.version = version
+        # One HyperLogLog sketch of Invoice IDs per row of ``tables[()]``
+        self.invoice_sketches = invoice_sketches
+
+    @property
+    def cell_count(self):
+        return sum(len(table) for table in self.tables.values())
+
+    def table_for(self, by):
+        extras = {col for col in by if col not in FILTER_COLUMNS}
+        for grouping in sorted(self.tables, key=len):
+            if extras <= set(grouping):
+                return self.tables[grouping]
+        raise KeyError(f"cube has no grouping covering {sorted(extras)}")
+
+    def query(self, selection, by=()):
+        """Sum the cube cells matching ``selection``.
+
+        ``selection`` maps filter columns to the selected values. Returns a
+        frame indexed by ``by`` with the measure sums and a ``count`` column,
+        or a Series of totals when ``by`` is empty.
+        """
+        by = list(by)
+        table = self.table_for(by)
+        mask = cell_mask(table, selection)
+        cells = table if mask is None else table[mask]
+        if not by:
+            return cells[MEASURES + ['count']].sum()
+        return cells.groupby(by, observed=True)[MEASURES + ['count']].sum()
+
+    def distinct_invoices(self, selection):
+        """Approximate number of distinct Invoice IDs matching ``selection``."""
+        mask = cell_mask(self.tables[()], selection)
+        sketches = self.invoice_sketches if mask is None else self.invoice_sketches[mask.to_numpy()]
+        if not len(sketches):
+            return 0.0
+        return hll_estimate(sketches.max(axis=0))
+
+
+def cell_mask(table, selection):
+    """Boolean mask of the cells of ``table`` matching ``selection`` (None = all of them)."""
+    mask = None
+    for col, values in selection.items():
+        column = table[col]
+        # Skip columns where every value is selected (the default state)
+        if set(values) >= set(column.cat.categories):
+            continue
+        col_mask = column.isin(values)
+        mask = col_mask if mask is None else mask & col_mask
+    return mask
+
+
+def build_cube(df, version=None):
+    """Aggregate ``df`` into one cube table per entry of ``GROUPINGS``."""
+    frame = df[FILTER_COLUMNS + ['Product line', 'Payment']].copy()
+    # Summed at full width whatever the frame's layout
+    for col in MEASURES:
+        frame[col] = sales_column(df, col).astype(np.int64 if col == 'Quantity' else np.float64)
+    for dimension, keys in time_keys(df).items():
+        frame[dimension] = keys
+    frame['rating_bin'] = frame['Rating'].round(1)
+    frame['count'] = 1
+    tables = {}
+    for grouping in GROUPINGS:
+        keys = FILTER_COLUMNS + list(grouping)
+        tables[grouping] = frame.groupby(keys, observed=True)[MEASURES + ['count']].sum().reset_index()
+    # Cell ids follow the sorted group order of tables[()]
+    cells = frame.groupby(FILTER_COLUMNS, observed=True).ngroup().to_numpy()
+    sketches = hll_registers(invoice_hashes(df['Invoice ID']), cells, len(tables[()]))
+    return SalesCube(tables, version, sketches)
+
+
+def merge_cubes(cubes, version=None):
+    """Combine cubes built from disjoint parts of the data into one."""
+    tables = {}
+    for grouping in GROUPINGS:
+        parts = [cube.tables[grouping] for cube in cubes]
+        combined = pd.concat(parts, ignore_index=True)
+        # Chunks may have seen different category sets; union them before grouping
+        for col in FILTER_COLUMNS + [col for col in grouping if col in ('Product line', 'Payment')]:
+            combined[col] = combined[col].astype('category')
+        keys = FILTER_COLUMNS + list(grouping)
+        grouped = combined.groupby(keys, observed=True)
+        tables[grouping] = grouped[MEASURES + ['count']].sum().reset_index()
+        if not grouping:
+            cells = grouped.ngroup().to_numpy()
+    sketches = np.concatenate([cube.invoice_sketches for cube in cubes])
+    return SalesCube(tables, version, hll_merge(sketches, cells, len(tables[()])))
+
+
+# Process-wide memo: path -> cube of the current file version
+_cubes = {}
+_cubes_lock = threading.Lock()
+
+
+def load_cube(path=DATA_PATH):
+    """Cube of the current version of ``path``; appended rows are merged in, not rebuilt."""
+    with _cubes_lock:
+        version = data_version(path)
+        cube = _cubes.get(path)
+        if cube is not None and cube.version != version:
+            rows = appended_since(path, cube.version, until=version)
+            cube = None if rows is None else merge_cubes([cube, build_cube(rows)], version)
+        if cube is None:
+            # Only the columns the cube needs, and not memoized: pages keep their own projections
+            df, version = load_sales(path, columns=CUBE_COLUMNS, keep=False)
+            cube = build_cube(df, version)
+        _cubes[path] = cube
+        return cube
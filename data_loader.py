@@ -0,0 +1,409 @@
+"""Loading of the supermarket sales export used by the dashboard.
+
+The CSV is parsed once per content version into an uncompressed Feather
+(Arrow IPC) snapshot next to it. Later loads memory-map that snapshot and
+only materialize the columns the caller asks for; one frame per version is
+shared by every session, and column subsets of it are views.
+
+With ``compact=True`` (``DASHBOARD_COMPACT=1``) frames are kept in a compact
+layout: Invoice IDs packed into integers, Time folded into the Date
+timestamp, narrower numeric types and no columns derivable from the others
+(``sales_column`` recomputes them, ``expand_frame`` restores the export
+layout).
+
+Rows appended to the file are picked up incrementally: a watermark (byte
+offset plus a digest of the bytes just before it) identifies the part that
+was already parsed, only the new bytes are read, and their rows are kept as
+deltas on top of the last full version. Consumers holding state for an
+earlier version (frames, cube, filter index) fold in ``appended_since``
+instead of rebuilding. A shrunk or rewritten file, or appended rows whose
+``Invoice ID`` was already seen, fall back to a full rebuild.
+"""
+import functools
+import hashlib
+import io
+import os
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+import pyarrow.feather as feather
+
+# The sales export, or a directory of partition files (see partitions.py)
+DATA_PATH = os.environ.get('DASHBOARD_DATA_PATH', 'supermarket_sales.csv')
+SNAPSHOT_DIR = '.snapshots'
+
+# Column order of the export
+COLUMNS = [
+    'Invoice ID', 'Branch', 'City', 'Customer type', 'Gender', 'Product line',
+    'Unit price', 'Quantity', 'Tax 5%', 'Total', 'Date', 'Time', 'Payment',
+    'cogs', 'gross margin percentage', 'gross income', 'Rating',
+]
+FILTER_COLUMNS = ['Branch', 'City', 'Customer type', 'Gender']
+
+# Explicit column types so pandas does not have to infer them on every parse
+CATEGORY_COLUMNS = ['Branch', 'City', 'Customer type', 'Gender', 'Product line', 'Payment']
+DTYPES = {
+    'Invoice ID': 'object',
+    'Branch': 'category',
+    'City': 'category',
+    'Customer type': 'category',
+    'Gender': 'category',
+    'Product line': 'category',
+    'Unit price': 'float64',
+    'Quantity': 'int64',
+    'Tax 5%': 'float64',
+    'Total': 'float64',
+    'Time': 'object',
+    'Payment': 'category',
+    'cogs': 'float64',
+    'gross margin percentage': 'float64',
+    'gross income': 'float64',
+    'Rating': 'float64',
+}
+DATE_FORMAT = '%m/%d/%Y'
+
+# Compact layout: columns recomputed from the others, and narrower dtypes
+GROSS_MARGIN_PERCENTAGE = 4.761904762
+DERIVED_COLUMNS = {
+    'Tax 5%': lambda df: (df['cogs'] * 0.05).round(4),
+    'gross margin percentage': lambda df: pd.Series(GROSS_MARGIN_PERCENTAGE, index=df.index),
+    'gross income': lambda df: (df['cogs'] * 0.05).round(4),
+}
+COMPACT_DTYPES = {'Quantity': 'int8', 'Rating': 'float32'}
+COMPACT = os.environ.get('DASHBOARD_COMPACT', '0') == '1'
+
+# Bytes before the watermark whose digest must be unchanged for an append
+BOUNDARY_BYTES = 4096
+
+# Process-wide memos shared by every Streamlit session
+_versions = {}  # path -> (stat, digest, watermark)
+_frames = {}  # (path, columns) -> (digest, frame)
+_lineages = {}  # path -> (base digest, [(digest, appended rows), ...])
+_invoices = {}  # path -> (digest, sorted hashes of every Invoice ID)
+_cache_lock = threading.RLock()
+
+
+def file_stat(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_sales_csv(path, **kwargs):
+    """Parse the CSV once with fixed dtypes and date format."""
+    df = pd.read_csv(path, dtype=DTYPES, **kwargs)
+    df['Date'] = pd.to_datetime(df['Date'], format=DATE_FORMAT)
+    return df
+
+
+def append_rows(df, rows):
+    """``df`` followed by ``rows``, keeping category columns categorical."""
+    combined = pd.concat([df, rows[df.columns]])
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            combined[col] = union_categoricals([df[col], rows[col]], sort_categories=True)
+    return combined
+
+
+def pack_invoice_ids(ids):
+    """``NNN-NN-NNNN`` Invoice IDs as int32 numbers, or None if any ID has another form."""
+    ids = np.asarray(ids, dtype=object)
+    try:
+        # One extra byte so that longer IDs are detected instead of truncated
+        chars = ids.astype('S12').view(np.uint8).reshape(len(ids), 12)
+    except (UnicodeEncodeError, TypeError, ValueError):
+        return None
+    digits = np.delete(chars[:, :11], [3, 6], axis=1).astype(np.int32) - ord('0')
+    if ((digits < 0) | (digits > 9)).any() or (chars[:, [3, 6]] != ord('-')).any() or chars[:, 11].any():
+        return None
+    return digits @ (10 ** np.arange(8, -1, -1, dtype=np.int32))
+
+
+def unpack_invoice_ids(numbers):
+    """Inverse of ``pack_invoice_ids``."""
+    numbers = np.asarray(numbers, dtype=np.int64)
+    chars = np.full((len(numbers), 11), ord('-'), dtype=np.uint8)
+    for place, pos in enumerate([0, 1, 2, 4, 5, 7, 8, 9, 10]):
+        chars[:, pos] = ord('0') + numbers // 10**(8 - place) % 10
+    return chars.view('S11').ravel().astype(str).astype(object)
+
+
+def invoice_hashes(ids):
+    """64-bit hashes of Invoice IDs, used to spot re-sent invoices on append.
+
+    Packed and string IDs hash alike, so compact and full frames agree.
+    """
+    ids = np.asarray(ids)
+    packed = ids if np.issubdtype(ids.dtype, np.integer) else pack_invoice_ids(ids)
+    if packed is None:
+        return pd.util.hash_array(ids.astype(object))
+    return pd.util.hash_array(packed.astype(np.int64))
+
+
+def compact_frame(df):
+    """``df`` in the compact layout; only the columns it has are converted."""
+    df = df.copy()
+    if 'Invoice ID' in df:
+        packed = pack_invoice_ids(df['Invoice ID'])
+        if packed is not None:
+            df['Invoice ID'] = packed
+    if 'Date' in df and 'Time' in df:
+        hours_minutes = df.pop('Time').str.split(':', n=1, expand=True).astype(np.int64)
+        df['Date'] = df['Date'] + pd.to_timedelta(hours_minutes[0] * 60 + hours_minutes[1], unit='min')
+    for col, dtype in COMPACT_DTYPES.items():
+        if col in df:
+            df[col] = df[col].astype(dtype)
+    if 'cogs' in df:
+        df = df.drop(columns=[col for col in DERIVED_COLUMNS if col in df])
+    return df
+
+
+def sales_column(df, name):
+    """Column ``name`` of a full or compact frame, recomputed if the compact layout dropped it."""
+    if name in df:
+        return df[name]
+    if name == 'Time':
+        return df['Date'].dt.strftime('%H:%M')
+    return DERIVED_COLUMNS[name](df)
+
+
+def expand_frame(df):
+    """Export layout (column order, dtypes, derived columns) of a full or compact frame."""
+    if 'Date' in df and 'Time' not in df:
+        df = df.assign(Time=sales_column(df, 'Time'), Date=df['Date'].dt.normalize())
+    else:
+        df = df.copy()
+    if 'Invoice ID' in df and pd.api.types.is_integer_dtype(df['Invoice ID']):
+        df['Invoice ID'] = unpack_invoice_ids(df['Invoice ID'])
+    if 'cogs' in df:
+        for col in DERIVED_COLUMNS:
+            df[col] = sales_column(df, col)
+    df = df.astype({col: DTYPES[col] for col in ['Invoice ID', 'Time', *COMPACT_DTYPES] if col in df})
+    if 'Rating' in df:
+        # float32 widens 9.1 to 9.100000381469727; ratings are recorded to 0.1
+        df['Rating'] = df['Rating'].round(1)
+    return df[[col for col in COLUMNS if col in df]]
+
+
+def register_invoices(path, digest, hashes):
+    """Record the Invoice ID hashes of version ``digest`` for duplicate detection on append."""
+    with _cache_lock:
+        _invoices[os.path.abspath(path)] = (digest, np.sort(hashes))
+
+
+class Watermark:
+    """Position up to which ``path`` has been parsed."""
+
+    def __init__(self, offset, boundary, ends_with_newline):
+        self.offset = offset
+        self.boundary = boundary
+        self.ends_with_newline = ends_with_newline
+
+    @classmethod
+    def at(cls, path, offset):
+        with open(path, 'rb') as handle:
+            header = handle.readline()
+            start = max(0, offset - BOUNDARY_BYTES)
+            handle.seek(start)
+            tail = handle.read(offset - start)
+        boundary = hashlib.blake2b(header + tail, digest_size=16).hexdigest()
+        return cls(offset, boundary, tail.endswith(b'\n'))
+
+
+def snapshot_path(path, digest):
+    folder = os.path.join(os.path.dirname(path), SNAPSHOT_DIR)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(folder, f'{stem}-{digest}.feather')
+
+
+def remove_stale_snapshots(path, target):
+    """Delete the snapshots of ``path`` other than ``target`` (same extension).
+
+    Only ``<stem>-<digest><ext>`` names are matched, so snapshots of another
+    export whose name merely starts with the stem are left alone.
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    extension = os.path.splitext(target)[1]
+    pattern = re.compile(re.escape(stem) + r'-[0-9a-f]{32}' + re.escape(extension))
+    folder = os.path.dirname(target)
+    for name in os.listdir(folder):
+        stale = os.path.join(folder, name)
+        if pattern.fullmatch(name) and stale != target:
+            os.remove(stale)
+
+
+def build_snapshot(path, digest):
+    """Convert ``path`` to a Feather snapshot and drop snapshots of older versions."""
+    df = read_sales_csv(path)
+    target = snapshot_path(path, digest)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp = f'{target}.{os.getpid()}.tmp'
+    # Uncompressed and in one record batch so the file can be memory-mapped and
+    # its numeric columns handed to pandas without decoding or copying
+    feather.write_feather(df, tmp, compression='uncompressed', chunksize=max(len(df), 1))
+    os.replace(tmp, target)
+    remove_stale_snapshots(path, target)
+    return df
+
+
+def _read_append(path, size, digest, watermark):
+    """Rows appended after ``watermark``, or None when the change is not a clean append."""
+    if size <= watermark.offset or Watermark.at(path, watermark.offset).boundary != watermark.boundary:
+        return None  # truncated or rewritten
+    known = _invoices.get(path)
+    if known is None or known[0] != digest:
+        return None  # nothing to check duplicates against
+    with open(path, 'rb') as handle:
+        handle.seek(watermark.offset)
+        new_bytes = handle.read(size - watermark.offset)
+    # A row the writer has not finished has no line ending yet; it is read once it does
+    new_bytes = new_bytes[:new_bytes.rfind(b'\n') + 1]
+    if not new_bytes.strip():
+        return new_bytes, empty_frame(), np.empty(0, dtype=np.uint64)
+    if not watermark.ends_with_newline and not new_bytes.startswith((b'\n', b'\r\n')):
+        return None  # the last parsed row was edited
+    rows = read_sales_csv(io.BytesIO(new_bytes.lstrip(b'\r\n')), header=None, names=COLUMNS)
+    hashes = np.sort(invoice_hashes(rows['Invoice ID']))
+    # Binary search in the sorted known hashes, so the check costs O(new rows * log rows)
+    found = known[1].take(np.searchsorted(known[1], hashes), mode='clip') == hashes if len(known[1]) else False
+    if (np.diff(hashes) == 0).any() or np.any(found):
+        return None  # duplicate Invoice ID
+    rows.index = pd.RangeIndex(len(known[1]), len(known[1]) + len(rows))
+    return new_bytes, rows, hashes
+
+
+def empty_frame():
+    return read_sales_csv(io.StringIO(','.join(COLUMNS)))
+
+
+def data_version(path=DATA_PATH):
+    """Version digest of ``path``; the file is only re-read when its size or mtime moved.
+
+    A clean append chains the previous digest with the appended bytes, so it
+    costs O(new bytes); any other change re-hashes the whole file. Appended
+    bytes are consumed up to the last line ending, so a row still being
+    written is left for a later call.
+    """
+    path = os.path.abspath(path)
+    stat = file_stat(path)
+    with _cache_lock:
+        cached = _versions.get(path)
+        if cached is not None and cached[0] == stat:
+            return cached[1]
+        if cached is not None:
+            appended = _read_append(path, stat[0], cached[1], cached[2])
+            if appended is not None:
+                new_bytes, rows, hashes = appended
+                if not new_bytes.strip():
+                    # Only line endings or an unfinished row so far: same rows, same version
+                    _versions[path] = (stat, cached[1], Watermark.at(path, cached[2].offset + len(new_bytes)))
+                    return cached[1]
+                digest = hashlib.blake2b(cached[1].encode() + new_bytes, digest_size=16).hexdigest()
+                known = _invoices[path][1]
+                # Inserted at their sorted positions instead of re-sorting every hash
+                _invoices[path] = (digest, np.insert(known, np.searchsorted(known, hashes), hashes))
+                base, deltas = _lineages[path]
+                _lineages[path] = (base, deltas + [(digest, rows)])
+                _versions[path] = (stat, digest, Watermark.at(path, cached[2].offset + len(new_bytes)))
+                return digest
+        digest = file_digest(path)
+        _versions[path] = (stat, digest, Watermark.at(path, stat[0]))
+        # A touched but unchanged file keeps its lineage
+        if cached is None or cached[1] != digest:
+            _lineages[path] = (digest, [])
+        return digest
+
+
+def appended_since(path, version, until=None):
+    """Rows appended to ``path`` after ``version``, or None if ``version`` is not an ancestor.
+
+    Only rows up to version ``until`` (default: the current version) are
+    included, so a consumer updating itself to a version it resolved earlier
+    does not pick up later appends. An empty frame means ``version`` is that
+    version.
+    """
+    path = os.path.abspath(path)
+    current = data_version(path) if until is None else until
+    with _cache_lock:
+        base, deltas = _lineages.get(path, (current, []))
+    versions = [base] + [digest for digest, _ in deltas]
+    if version not in versions or current not in versions or versions.index(version) > versions.index(current):
+        return None
+    after = [rows for _, rows in deltas[versions.index(version):versions.index(current)]]
+    if not after:
+        return empty_frame()
+    return functools.reduce(append_rows, after)
+
+
+def _read_snapshot(target, columns):
+    table = feather.read_table(target, columns=list(columns) if columns else None, memory_map=True)
+    # One block per column lets numeric columns stay views of the mapped file, whose
+    # pages are then shared by every process serving this version
+    return table.to_pandas(split_blocks=True)
+
+
+def load_sales(path=DATA_PATH, columns=None, compact=COMPACT, keep=True):
+    """Return ``(frame, version)`` for ``path``, reparsing only when the file changed.
+
+    ``columns`` restricts the frame to a subset of the export (kept in file
+    order); only those columns are read from the snapshot. With ``compact``
+    the frame is in the compact layout (see ``compact_frame``). ``version``
+    is the content digest and is meant to be used in downstream cache keys.
+    ``keep=False`` loads a frame for one-off use (e.g. building an aggregate)
+    without memoizing it.
+    """
+    path = os.path.abspath(path)
+    if columns is not None:
+        columns = tuple(col for col in COLUMNS if col in columns)
+    key = (path, columns, compact)
+
+    def layout(frame):
+        if columns is not None:
+            frame = frame[list(columns)]
+        return compact_frame(frame) if compact else frame
+
+    with _cache_lock:
+        digest = data_version(path)
+        cached = _frames.get(key)
+        if cached is not None and cached[0] == digest:
+            return cached[1], digest
+        base, deltas = _lineages[path]
+        df = None
+        full = _frames.get((path, None, compact))
+        if columns is not None and full is not None and full[0] == digest and set(columns) <= set(full[1]):
+            # Column subsets share the arrays of the loaded full frame instead of copying them
+            df = pd.DataFrame({col: full[1][col] for col in columns}, copy=False)
+        if df is None and cached is not None:
+            # Fold in the rows appended since the memoized version
+            rows = appended_since(path, cached[0], until=digest)
+            if rows is not None:
+                df = append_rows(cached[1], layout(rows))
+        if df is None and os.path.exists(snapshot_path(path, base)):
+            df = _read_snapshot(snapshot_path(path, base), columns)
+            for _, rows in deltas:
+                df = append_rows(df, rows)
+            if _invoices.get(path, (None,))[0] != base and not deltas:
+                ids = _read_snapshot(snapshot_path(path, base), ['Invoice ID'])['Invoice ID']
+                register_invoices(path, base, invoice_hashes(ids))
+            df = layout(df)
+        if df is None:
+            df = build_snapshot(path, digest)
+            _lineages[path] = (digest, [])
+            register_invoices(path, digest, invoice_hashes(df['Invoice ID']))
+            df = layout(df)
+        # Drop frames of previous versions of this file
+        for other in [k for k, v in _frames.items() if k[0] == path and v[0] != digest]:
+            del _frames[other]
+        if keep:
+            _frames[key] = (digest, df)
+        return df, digest
@@ -0,0 +1,260 @@
+"""Headless aggregation engine behind the dashboard pages.
+
+``SalesEngine`` bundles one data version (row frame, aggregate cube and
+filter index, or a DuckDB database standing in for all three) of a single
+export or of a partitioned source directory, and exposes every computation
+the pages show, memoized per filter selection. It does not depend on
+Streamlit, so the pages' work can be imported, profiled and benchmarked on
+its own (see ``benchmark.py``).
+"""
+import os
+
+import aggregations as agg
+from aggregations import cache_key
+from cube import build_cube, load_cube
+from data_loader import DATA_PATH, FILTER_COLUMNS, data_version, expand_frame, load_sales
+from filter_index import FilterIndex, RowSelection, load_index
+from instrumentation import stage
+from partitions import PartitionChanged, load_catalog, load_partitioned, partition_set_version
+from sql_backend import load_sql_cube
+from streaming import load_streamed
+
+PAGES = [
+    "Overview", "Research Question 1", "Research Question 2",
+    "Research Question 3", "Research Question 4",
+    "Research Question 5", "Research Question 6",
+]
+
+# Times ``SalesEngine.load`` loads a file that keeps changing before giving up
+LOAD_ATTEMPTS = 5
+
+# Raw-row columns each page reads besides the sidebar filters (None = every column);
+# everything else is answered from the aggregate cube
+PAGE_COLUMNS = {
+    "Overview": None,
+    "Research Question 1": [],
+    "Research Question 2": [],
+    "Research Question 3": [],
+    "Research Question 4": [],
+    "Research Question 5": ['Gender', 'Product line', 'Rating', 'Total'],
+    "Research Question 6": [],
+}
+
+# Engine methods (with their extra arguments) each page displays
+PAGE_AGGREGATIONS = {
+    "Overview": [
+        ('kpis',), ('customer_count',), ('sample_rows',), ('product_line_summary',),
+        ('branch_city_revenue',), ('customer_type_gender_counts',), ('sales_trend',),
+    ],
+    "Research Question 1": [('sales_trend', 'month'), ('hourly_sales',)],
+    "Research Question 2": [
+        ('sales_by', 'Gender'), ('purchase_counts', 'Gender'), ('purchase_counts', 'Customer type'),
+    ],
+    "Research Question 3": [('sales_by', 'Product line')],
+    "Research Question 4": [('sales_by', 'Branch'), ('product_city_sales',)],
+    "Research Question 5": [('rows',), ('rating_quartiles', 'Product line')],
+    "Research Question 6": [('sales_by', 'Payment'), ('rating_quartiles', 'Payment')],
+}
+
+
+class SalesEngine:
+    def __init__(self, frame, cube, index, version, domains, sampled=False, cache=agg.results,
+                 positions=agg.positions, catalog=None):
+        self.frame = frame
+        self.cube = cube
+        self.index = index
+        self.version = version
+        self.domains = domains
+        # True when ``frame`` is a row sample rather than every row (chunked ingestion)
+        self.sampled = sampled
+        self.cache = cache
+        # Row positions of selections, kept apart from ``cache`` because they grow with the data
+        self.positions = positions
+        # Partition catalog when the source is a directory (see partitions.py)
+        self.catalog = catalog
+
+    @classmethod
+    def from_frame(cls, df, version='adhoc', **kwargs):
+        """Engine over an in-memory frame, e.g. synthetic benchmark data."""
+        domains = {col: list(df[col].unique()) for col in FILTER_COLUMNS}
+        return cls(df, build_cube(df, version), FilterIndex(df, version=version), version, domains, **kwargs)
+
+    @classmethod
+    def load(cls, path=DATA_PATH, mode='memory', page=None):
+        """Engine over the current version of ``path``.
+
+        ``mode='memory'`` loads the columns ``page`` needs (every column when
+        no page is given); ``mode='chunked'`` streams the file into aggregates
+        and keeps a bounded row sample; ``mode='duckdb'`` answers everything
+        with SQL over a DuckDB database built from the file. A directory of
+        partition files is served from its partitions' cubes (see
+        ``from_catalog`` and ``pruned``).
+        """
+        if os.path.isdir(path):
+            if mode != 'memory':
+                raise ValueError(f"partitioned sources are loaded in memory, not with mode={mode!r}")
+            return cls.from_catalog(path)
+        if mode == 'duckdb':
+            return cls.from_sql(path)
+        if mode == 'chunked':
+            streamed = load_streamed(path)
+            domains = {col: list(streamed.cube.tables[()][col].unique()) for col in FILTER_COLUMNS}
+            return cls(streamed.sample, streamed.cube, streamed.index, streamed.version, domains, sampled=True)
+        page_columns = PAGE_COLUMNS.get(page)
+        columns = None if page_columns is None else FILTER_COLUMNS + page_columns
+        # Each part resolves the file's version on its own; rows appended in between would
+        # leave them at different versions, so load again (incrementally) until they agree
+        for _ in range(LOAD_ATTEMPTS):
+            version = data_version(path)
+            cube, index = load_cube(path), load_index(path)
+            frame, frame_version = load_sales(path, columns=columns)
+            if cube.version == index.version == frame_version == version:
+                domains = {col: list(frame[col].unique()) for col in FILTER_COLUMNS}
+                return cls(frame, cube, index, version, domains)
+        raise RuntimeError(f'{path} kept changing while it was being loaded')
+
+    @classmethod
+    def from_catalog(cls, path, selection=None, dates=None, **kwargs):
+        """Engine over the partitions of directory ``path`` that may hold rows matching ``selection`` and ``dates``.
+
+        Aggregations come from the partitions' cubes; no frame is kept, and
+        rows are read per selection when a page asks for them.
+        """
+        for _ in range(LOAD_ATTEMPTS):
+            catalog = load_catalog(path)
+            try:
+                cube = load_partitioned(catalog.prune(selection or {}, dates), dates)
+            except PartitionChanged:
+                # Reloading the catalog rescans the changed file
+                continue
+            return cls(None, cube, None, cube.version, catalog.domains, catalog=catalog, **kwargs)
+        raise RuntimeError(f'{path} kept changing while it was being loaded')
+
+    @classmethod
+    def from_sql(cls, path=DATA_PATH, **kwargs):
+        """Engine whose aggregations and rows are queried from DuckDB (no frame in memory)."""
+        cube = load_sql_cube(path)
+        return cls(None, cube, None, cube.version, cube.domains, **kwargs)
+
+    @property
+    def row_count(self):
+        return self.cube.row_count if self.frame is None else len(self.frame)
+
+    def pruned(self, selection, dates=None):
+        """Engine over only the partitions that may hold rows matching ``selection`` and ``dates``.
+
+        ``dates`` is an inclusive ``(first, last)`` range; rows outside it are
+        dropped. Partitions are taken from this engine's catalog, so the data
+        version does not move. Single-file sources are returned unchanged.
+        """
+        if self.catalog is None:
+            return self
+        partitions = self.catalog.prune(selection, dates)
+        if partition_set_version(partitions, dates) == self.version:
+            return self
+        kwargs = {'cache': self.cache, 'positions': self.positions}
+        try:
+            cube = load_partitioned(partitions, dates)
+        except PartitionChanged:
+            # The catalog is out of date; use the files' current state
+            return type(self).from_catalog(self.catalog.root, selection, dates, **kwargs)
+        return type(self)(None, cube, None, cube.version, self.domains, catalog=self.catalog, **kwargs)
+
+    def default_selection(self):
+        """Every value of every filter column selected."""
+        return {col: list(values) for col, values in self.domains.items()}
+
+    def _cached(self, name, selection, compute, *params, cache=None):
+        key = cache_key(name, self.version, selection, params, self.domains)
+        # Timed in the rerun profile of the calling session, cache hits included
+        with stage('compute', name):
+            return (self.cache if cache is None else cache).get_or_compute(key, compute)
+
+    def rows(self, selection):
+        """Rows (sampled rows in chunked mode) matching ``selection``, as a view of the shared frame.
+
+        Only the row positions are computed, and they are cached across sessions.
+        Without a frame the rows are fetched from the SQL backend when asked for.
+        """
+        if self.frame is None and self.catalog is not None:
+            # Only the partitions that may hold the selection's rows are read
+            sales = self.cube.sales(selection)
+            rows = self._cached('positions', selection, lambda: sales.index.select(selection), cache=self.positions)
+            return RowSelection(sales.frame, rows)
+        if self.frame is None:
+            return self.cube.rows(selection)
+        rows = self._cached('positions', selection, lambda: self.index.select(selection), cache=self.positions)
+        return RowSelection(self.frame, rows)
+
+    def kpis(self, selection):
+        return self._cached('kpis', selection, lambda: agg.kpis(self.cube, selection))
+
+    def customer_count(self, selection, exact=None):
+        """Distinct Invoice IDs: exact on small in-memory data, otherwise from the cube's sketches."""
+        if exact is None:
+            exact = not self.sampled and self.row_count <= agg.EXACT_DISTINCT_ROWS
+        if exact:
+            return self._cached('customer_count', selection, lambda: agg.customer_count(self.rows(selection)))
+        return self._cached(
+            'approx_customer_count', selection, lambda: agg.approx_customer_count(self.cube, selection)
+        )
+
+    def sample_rows(self, selection, n=5):
+        """First ``n`` matching rows in the export's layout, even for compact frames."""
+        if self.frame is None and self.catalog is not None:
+            return expand_frame(self.cube.head(selection, n))
+        return expand_frame(self.rows(selection).head(n))
+
+    def product_line_summary(self, selection):
+        return self._cached('product_line_summary', selection, lambda: agg.product_line_summary(self.cube, selection))
+
+    def branch_city_revenue(self, selection):
+        return self._cached('branch_city_revenue', selection, lambda: agg.branch_city_revenue(self.cube, selection))
+
+    def customer_type_gender_counts(self, selection):
+        return self._cached(
+            'customer_type_gender_counts', selection, lambda: agg.customer_type_gender_counts(self.cube, selection)
+        )
+
+    def sales_trend(self, selection, granularity='auto'):
+        return self._cached(
+            'sales_trend', selection, lambda: agg.sales_trend(self.cube, selection, granularity), granularity
+        )
+
+    def hourly_sales(self, selection):
+        return self._cached('hourly_sales', selection, lambda: agg.hourly_sales(self.cube, selection))
+
+    def sales_by(self, selection, column):
+        return self._cached('sales_by', selection, lambda: agg.sales_by(self.cube, selection, column), column)
+
+    def purchase_counts(self, selection, column):
+        return self._cached(
+            'purchase_counts', selection, lambda: agg.purchase_counts(self.cube, selection, column), column
+        )
+
+    def product_city_sales(self, selection, max_rows=agg.HEATMAP_MAX_ROWS):
+        return self._cached(
+            'product_city_sales', selection, lambda: agg.product_city_sales(self.cube, selection, max_rows), max_rows
+        )
+
+    def rating_quartiles(self, selection, column):
+        return self._cached(
+            'rating_quartiles', selection, lambda: agg.rating_quartiles(self.cube, selection, column), column
+        )
+
+    def scatter_sample(self, selection, size):
+        return self._cached(
+            'stratified_sample', selection, lambda: agg.stratified_sample(self.rows(selection), size), size
+        )
+
+    def rating_density(self, selection):
+        return self._cached(
+            'rating_total_density', selection, lambda: agg.rating_total_density(self.rows(selection))
+        )
+
+    def page(self, name, selection):
+        """Every aggregation ``name`` displays, keyed by method name and arguments."""
+        return {
+            spec: getattr(self, spec[0])(selection, *spec[1:])
+            for spec in PAGE_AGGREGATIONS[name]
+        }
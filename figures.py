@@ -0,0 +1,514 @@
+"""Plotly figure builders for the dashboard pages and a cache of their specs.
+
+Fonts and the light plot background shared by the pages live in the
+``dashboard`` / ``dashboard_light`` templates instead of being re-applied to
+every figure. Built figures are kept as serialized JSON specs in a cache
+keyed by chart id, data version and filter selection, bounded by total size.
+``chart_inputs`` wires each chart to the engine results it plots, for both
+the dashboard and the report export.
+"""
+import os
+
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
+from plotly.subplots import make_subplots
+
+from aggregations import LRUCache, cache_key
+
+pio.templates['dashboard'] = go.layout.Template(layout=dict(
+    title_font_size=24,
+    legend_font_size=16,
+    xaxis_title_font_size=18,
+    yaxis_title_font_size=18,
+))
+pio.templates['dashboard_light'] = go.layout.Template(layout=dict(
+    plot_bgcolor='rgb(245, 245, 245)',  # Light background for contrast
+))
+TEMPLATE = 'plotly+dashboard'
+LIGHT_TEMPLATE = 'plotly+dashboard+dashboard_light'
+DARK_TEMPLATE = 'plotly_dark+dashboard'
+
+GENDER_COLORS = {
+    'Male': 'rgb(52, 50, 163)',
+    'Female': 'rgb(141, 148, 189)'
+}
+PRODUCT_LINE_COLORS = [
+    'rgb(52, 50, 163)', 'rgb(141, 148, 189)', 'rgb(83, 92, 145)', 'rgb(68, 68, 68)',
+    'rgb(111, 115, 178)', 'rgb(75, 73, 165)'
+]
+
+# Above this many filtered rows the Research Question 5 scatter stops plotting every row
+SCATTER_ROW_THRESHOLD = int(os.environ.get('DASHBOARD_SCATTER_THRESHOLD', 20000))
+SCATTER_SAMPLE_SIZE = 10000
+
+figures = LRUCache(maxsize=None, maxbytes=64 * 1024 * 1024, sizeof=len)
+
+
+def cached_figure(chart_id, version, selection, build, *args, domains=None, cache=figures):
+    """Return ``(figure, JSON spec)`` of ``build(*args)``, reusing the cached spec.
+
+    The key is built like the engine's result keys (``cache_key``): chart
+    id, data version, canonical selection and any scalar arguments of ``build``.
+    The spec is what the figure is sent to the browser as.
+    """
+    key = cache_key(chart_id, version, selection, args, domains)
+    built = []
+
+    def compute():
+        fig = build(*args)
+        built.append(fig)
+        return fig.to_json()
+
+    spec = cache.get_or_compute(key, compute)
+    return (built[0] if built else pio.from_json(spec)), spec
+
+
+# --- Overview ---
+
+def product_sales_pie(product_sales):
+    return px.pie(
+        product_sales,
+        values='Total_Revenue',
+        names='Product line',
+        title="Sales by Product Line",
+        color_discrete_sequence=["#535C91", "#1B1A55", "#9290C3", "#070F2B"],
+        template=TEMPLATE
+    )
+
+
+def customer_demographics_pie(customer_type_gender):
+    return px.pie(
+        customer_type_gender,
+        values='Count',
+        names='Customer type',
+        title="Customer Type by Membership",
+        color='Customer type',
+        color_discrete_sequence=["rgb(52, 50, 163)", "rgb(141, 148, 189)"],  # Updated color scheme
+        template=TEMPLATE
+    )
+
+
+def branch_city_bar(branch_city_sales):
+    return px.bar(
+        branch_city_sales,
+        x='Branch',
+        y='Total_Revenue',
+        color='City',
+        title="Total Revenue by Branch and City",
+        barmode='stack',
+        color_continuous_scale=px.colors.sequential.Purples,
+        labels={'Total_Revenue': 'Total Revenue', 'Branch': 'Branch'},
+        template=TEMPLATE
+    )
+
+
+TREND_LABELS = {'day': "Daily", 'week': "Weekly", 'month': "Monthly"}
+
+
+def daily_sales_line(trend):
+    fig = px.line(
+        trend['data'],
+        x='Date',
+        y='Total',
+        title=f"Sales Trends ({TREND_LABELS[trend['granularity']].lower()})",
+        labels={'Date': 'Date', 'Total': 'Total Revenue'},
+        color_discrete_sequence=["#9290C3"],
+        template=TEMPLATE
+    )
+    fig.update_layout(
+        xaxis_tickangle=-45,
+        xaxis_title="Date",
+        yaxis_title="Total Revenue"
+    )
+    return fig
+
+
+# --- Research Question 1 ---
+
+def monthly_sales_line(trend):
+    fig = px.line(
+        trend['data'],
+        x='Date',
+        y='Total',
+        title="Monthly Total Sales Over Time",
+        labels={'Date': 'Date', 'Total': 'Total Sales'},
+        template=DARK_TEMPLATE
+    )
+    fig.update_layout(
+        xaxis_title="Date",
+        yaxis_title="Total Sales",
+        xaxis_tickangle=-45
+    )
+    return fig
+
+
+def hourly_sales_bar(hourly_sales):
+    fig = px.bar(
+        hourly_sales,
+        x='Hour',
+        y='Total',
+        title="Total Sales by Hour of Day",
+        labels={'Hour': 'Hour of Day', 'Total': 'Total Sales'},
+        color_discrete_sequence=["#9290C3"],
+        template=DARK_TEMPLATE
+    )
+    fig.update_layout(
+        xaxis_title="Hour of Day",
+        yaxis_title="Total Sales",
+        xaxis_dtick=1
+    )
+    return fig
+
+
+# --- Research Question 2 ---
+
+def sales_by_gender_bar(sales_by_gender):
+    fig = px.bar(
+        sales_by_gender,
+        x='Gender',
+        y='Total',
+        title="Total Sales by Gender",
+        color='Gender',
+        labels={'Total': 'Total Sales'},
+        color_discrete_map=GENDER_COLORS,
+        template=LIGHT_TEMPLATE
+    )
+    fig.update_layout(
+        xaxis_title="Gender",
+        yaxis_title="Total Sales",
+        xaxis_tickangle=0
+    )
+    return fig
+
+
+def purchase_counts_bar(counts, column, title, color_discrete_map):
+    fig = px.bar(
+        counts,
+        x='Product line',
+        y='Count',
+        color=column,
+        barmode='group',
+        title=title,
+        labels={'Product line': 'Product Line', 'Count': 'Number of Purchases'},
+        color_discrete_map=color_discrete_map,
+        template=LIGHT_TEMPLATE
+    )
+    fig.update_layout(
+        xaxis_tickangle=-45,
+        xaxis_title="Product Line",
+        yaxis_title="Number of Purchases"
+    )
+    return fig
+
+
+def product_line_gender_bar(product_line_gender):
+    return purchase_counts_bar(product_line_gender, 'Gender', "Product Line Preferences by Gender", GENDER_COLORS)
+
+
+def product_line_customer_type_bar(product_line_customer_type):
+    return purchase_counts_bar(
+        product_line_customer_type,
+        'Customer type',
+        "Product Line Preferences by Customer Type",
+        {
+            'Member': 'rgb(83, 92, 145)',
+            'Normal': 'rgb(68, 68, 68)'
+        }
+    )
+
+
+# --- Research Question 3 ---
+
+def sales_by_product_bar(sales_by_product):
+    fig = px.bar(
+        sales_by_product,
+        x='Product line',
+        y='Total',
+        title="Total Sales by Product Line",
+        color='Product line',
+        color_discrete_sequence=PRODUCT_LINE_COLORS,
+        template=LIGHT_TEMPLATE
+    )
+    fig.update_layout(
+        xaxis_title="Product Line",
+        yaxis_title="Total Sales",
+        xaxis_tickangle=-45,
+        legend_title_text="Product Line"
+    )
+    return fig
+
+
+def revenue_contribution_pie(sales_by_product):
+    fig = px.pie(
+        sales_by_product,
+        names='Product line',
+        values='Total',
+        title="Revenue Contribution by Product Line",
+        color_discrete_sequence=PRODUCT_LINE_COLORS,
+        template=LIGHT_TEMPLATE
+    )
+    # Update traces to ensure all labels are placed inside
+    fig.update_traces(
+        textinfo='percent+label',
+        textposition='inside',  # Place all labels inside the chart
+        insidetextorientation='radial'  # Orient text radially for better fit
+    )
+    return fig
+
+
+# --- Research Question 4 ---
+
+def branch_sales_bar(branch_sales):
+    fig = px.bar(
+        branch_sales,
+        x='Branch',
+        y='Total',
+        title="Sales by Branch",
+        color='Branch',
+        color_discrete_sequence=['rgb(141, 148, 189)', 'rgb(83, 92, 145)', 'rgb(68, 68, 68)'],
+        template=LIGHT_TEMPLATE
+    )
+    fig.update_layout(
+        xaxis_title="Branch",
+        yaxis_title="Total Sales",
+        xaxis_tickangle=0
+    )
+    return fig
+
+
+def product_city_heatmap(product_city_sales):
+    # Cell values are formatted by Plotly on hover instead of shipping a string per cell
+    fig = go.Figure(data=go.Heatmap(
+        z=product_city_sales.values,
+        x=product_city_sales.columns,
+        y=product_city_sales.index,
+        hovertemplate="%{z:,.0f}",  # Comma-separated integers
+        colorscale='Blues',
+        colorbar=dict(title="Sales")
+    ))
+    fig.update_layout(
+        title="Product Sales by City and Product Line",
+        xaxis_title="City",
+        yaxis_title="Product Line",
+        template=LIGHT_TEMPLATE
+    )
+    return fig
+
+
+# --- Research Question 5 ---
+
+def scatter_mode(n_rows, requested='Auto', threshold=None):
+    """Rendering mode of the Research Question 5 scatter for ``n_rows`` points.
+
+    At or below the threshold every row is plotted (``'points'``). Above it
+    the rows are either stratified-sampled (``'sample'``, the automatic choice)
+    or binned server-side into a density heatmap (``'density'``).
+    """
+    threshold = SCATTER_ROW_THRESHOLD if threshold is None else threshold
+    if n_rows <= threshold:
+        return 'points'
+    return 'density' if requested == 'Density' else 'sample'
+
+
+def satisfaction_scatter(df_filtered, render_mode='auto'):
+    fig = px.scatter(
+        df_filtered,
+        x='Rating',
+        y='Total',
+        color='Gender',
+        facet_col='Product line',
+        facet_col_wrap=3,
+        title="Customer Satisfaction Rating vs. Sales Volume by Product Line",
+        color_discrete_sequence=['rgb(52, 50, 163)', 'rgb(83, 92, 145)'],
+        opacity=0.7,
+        facet_col_spacing=0.08,  # Adjust column spacing
+        facet_row_spacing=0.15,  # Adjust row spacing
+        render_mode=render_mode,
+        template=LIGHT_TEMPLATE
+    )
+    fig.update_layout(
+        xaxis_title="Customer Satisfaction Rating",
+        yaxis_title="Total Sales",
+        legend_title_text="Gender",
+        margin=dict(t=80, b=50, l=50, r=50)  # Add margins around the entire plot
+    )
+    # Adjust subplot titles to give more space between title and the graph
+    for annotation in fig.layout.annotations:
+        annotation['yshift'] = 10  # Move titles slightly higher to increase spacing
+    return fig
+
+
+def satisfaction_density(density):
+    product_lines = list(density['counts'])
+    # One empty row of facets when nothing matches
+    rows = max(-(-len(product_lines) // 3), 1)
+    fig = make_subplots(
+        rows=rows,
+        cols=3,
+        subplot_titles=product_lines,
+        shared_xaxes=True,
+        shared_yaxes=True,
+        horizontal_spacing=0.08,
+        vertical_spacing=0.15
+    )
+    zmax = max((counts.max() for counts in density['counts'].values()), default=0)
+    for i, product_line in enumerate(product_lines):
+        counts = density['counts'][product_line]
+        fig.add_trace(go.Heatmap(
+            x=density['rating'],
+            y=density['total'],
+            z=np.where(counts.T > 0, counts.T, np.nan),  # Leave empty bins transparent
+            zmin=0,
+            zmax=zmax,
+            coloraxis='coloraxis',
+            hovertemplate="Rating %{x:.1f}<br>Total %{y:,.0f}<br>%{z:,.0f} sales<extra></extra>"
+        ), row=i // 3 + 1, col=i % 3 + 1)
+    fig.update_layout(
+        title="Customer Satisfaction Rating vs. Sales Volume by Product Line (density)",
+        coloraxis=dict(colorscale='Blues', colorbar=dict(title="Sales")),
+        margin=dict(t=80, b=50, l=50, r=50),
+        template=LIGHT_TEMPLATE
+    )
+    fig.update_xaxes(title_text="Customer Satisfaction Rating", row=rows, col=1)
+    fig.update_yaxes(title_text="Total Sales", row=rows, col=1)
+    for annotation in fig.layout.annotations:
+        annotation['yshift'] = 10
+    return fig
+
+
+def rating_box(quartiles, title, xaxis_title, xaxis_tickangle=None):
+    # Box statistics are computed server-side so no raw rows are shipped
+    fig = go.Figure(data=go.Box(
+        x=list(quartiles.index),
+        q1=quartiles['q1'],
+        median=quartiles['median'],
+        q3=quartiles['q3'],
+        lowerfence=quartiles['lowerfence'],
+        upperfence=quartiles['upperfence'],
+        name='Rating',
+        marker_color='rgb(68, 68, 68)'
+    ))
+    fig.update_layout(
+        title=title,
+        template=LIGHT_TEMPLATE,
+        xaxis_title=xaxis_title,
+        yaxis_title="Satisfaction Rating",
+        xaxis_tickangle=xaxis_tickangle
+    )
+    return fig
+
+
+def product_rating_box(quartiles):
+    return rating_box(quartiles, "Customer Satisfaction Ratings by Product Line", "Product Line", -45)
+
+
+# --- Research Question 6 ---
+
+def payment_sales_bar(payment_sales):
+    fig = px.bar(
+        payment_sales,
+        x='Payment',
+        y='Total',
+        title="Sales by Payment Method",
+        color='Payment',
+        color_discrete_sequence=['rgb(52, 50, 163)', 'rgb(141, 148, 189)', 'rgb(83, 92, 145)'],
+        template=LIGHT_TEMPLATE
+    )
+    fig.update_layout(
+        xaxis_title="Payment Method",
+        yaxis_title="Total Sales",
+        xaxis_tickangle=0
+    )
+    return fig
+
+
+def payment_rating_box(quartiles):
+    return rating_box(quartiles, "Customer Satisfaction Ratings by Payment Method", "Payment Method")
+
+
+# --- Charts of each page ---
+
+# Charts each page shows by default, in order; Research Question 5's scatter
+# becomes rq5.satisfaction_density for selections too large to plot
+PAGE_CHARTS = {
+    "Overview": [
+        'overview.product_sales', 'overview.customer_demographics', 'overview.branch_city', 'overview.daily_sales',
+    ],
+    "Research Question 1": ['rq1.monthly_sales', 'rq1.hourly_sales'],
+    "Research Question 2": ['rq2.sales_by_gender', 'rq2.product_line_gender', 'rq2.product_line_customer_type'],
+    "Research Question 3": ['rq3.sales_by_product', 'rq3.revenue_contribution'],
+    "Research Question 4": ['rq4.branch_sales', 'rq4.product_city_heatmap'],
+    "Research Question 5": ['rq5.satisfaction_scatter', 'rq5.product_rating_box'],
+    "Research Question 6": ['rq6.payment_sales', 'rq6.payment_rating_box'],
+}
+
+# Row columns the Research Question 5 scatter plots
+SCATTER_COLUMNS = ['Gender', 'Product line', 'Rating', 'Total']
+
+
+def scatter_chart(mode):
+    """Chart id of the Research Question 5 scatter in ``mode`` (see ``scatter_mode``)."""
+    return 'rq5.satisfaction_density' if mode == 'density' else 'rq5.satisfaction_scatter'
+
+
+def chart_inputs(engine, chart_id, selection, mode='points'):
+    """``(build, args)`` of chart ``chart_id``: its figure builder and the engine results it plots.
+
+    Shared by the dashboard and the report export, so both draw the same
+    charts. ``mode`` is the Research Question 5 scatter mode.
+    """
+    if chart_id == 'overview.product_sales':
+        return product_sales_pie, (engine.product_line_summary(selection)['Total_Revenue'].sort_index().reset_index(),)
+    if chart_id == 'overview.customer_demographics':
+        return customer_demographics_pie, (engine.customer_type_gender_counts(selection),)
+    if chart_id == 'overview.branch_city':
+        return branch_city_bar, (engine.branch_city_revenue(selection),)
+    if chart_id == 'overview.daily_sales':
+        return daily_sales_line, (engine.sales_trend(selection),)
+    if chart_id == 'rq1.monthly_sales':
+        return monthly_sales_line, (engine.sales_trend(selection, 'month'),)
+    if chart_id == 'rq1.hourly_sales':
+        return hourly_sales_bar, (engine.hourly_sales(selection),)
+    if chart_id == 'rq2.sales_by_gender':
+        return sales_by_gender_bar, (engine.sales_by(selection, 'Gender'),)
+    if chart_id == 'rq2.product_line_gender':
+        return product_line_gender_bar, (engine.purchase_counts(selection, 'Gender'),)
+    if chart_id == 'rq2.product_line_customer_type':
+        return product_line_customer_type_bar, (engine.purchase_counts(selection, 'Customer type'),)
+    if chart_id == 'rq3.sales_by_product':
+        return sales_by_product_bar, (engine.sales_by(selection, 'Product line'),)
+    if chart_id == 'rq3.revenue_contribution':
+        return revenue_contribution_pie, (engine.sales_by(selection, 'Product line'),)
+    if chart_id == 'rq4.branch_sales':
+        return branch_sales_bar, (engine.sales_by(selection, 'Branch'),)
+    if chart_id == 'rq4.product_city_heatmap':
+        return product_city_heatmap, (engine.product_city_sales(selection),)
+    if chart_id == 'rq5.satisfaction_density':
+        return satisfaction_density, (engine.rating_density(selection),)
+    if chart_id == 'rq5.satisfaction_scatter' and mode == 'sample':
+        return satisfaction_scatter, (engine.scatter_sample(selection, SCATTER_SAMPLE_SIZE), 'webgl')
+    if chart_id == 'rq5.satisfaction_scatter':
+        # Rows are only gathered for what gets plotted
+        return satisfaction_scatter, (engine.rows(selection).frame(SCATTER_COLUMNS),)
+    if chart_id == 'rq5.product_rating_box':
+        return product_rating_box, (engine.rating_quartiles(selection, 'Product line'),)
+    if chart_id == 'rq6.payment_sales':
+        return payment_sales_bar, (engine.sales_by(selection, 'Payment'),)
+    if chart_id == 'rq6.payment_rating_box':
+        return payment_rating_box, (engine.rating_quartiles(selection, 'Payment'),)
+    raise ValueError(f'unknown chart {chart_id!r}')
+
+
+def page_charts(engine, page, selection):
+    """``(chart_id, build, args)`` of every chart ``page`` shows by default."""
+    if page not in PAGE_CHARTS:
+        raise ValueError(f'unknown page {page!r}')
+    mode = scatter_mode(len(engine.rows(selection))) if page == "Research Question 5" else 'points'
+    charts = []
+    for chart_id in PAGE_CHARTS[page]:
+        if chart_id == 'rq5.satisfaction_scatter':
+            chart_id = scatter_chart(mode)
+        charts.append((chart_id, *chart_inputs(engine, chart_id, selection, mode)))
+    return charts
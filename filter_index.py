@@ -0,0 +1,145 @@
+"""Bitmap index over the sidebar filter columns.
+
+Every value of Branch, City, Customer type and Gender gets a packed bitset
+of the rows holding it. A sidebar selection becomes unions of the selected
+values' bitsets per column and an intersection across columns, yielding the
+row positions to keep. A ``RowSelection`` hands those positions out over
+the shared frame instead of copying the rows.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from data_loader import DATA_PATH, FILTER_COLUMNS, appended_since, data_version, load_sales
+
+
+class FilterIndex:
+    def __init__(self, df, columns=FILTER_COLUMNS, version=None):
+        self.n_rows = len(df)
+        self.version = version
+        self.bitmaps = {}
+        for col in columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                codes, values = df[col].cat.codes.to_numpy(), df[col].cat.categories
+            else:
+                codes, values = pd.factorize(df[col])
+            self.bitmaps[col] = {value: np.packbits(codes == i) for i, value in enumerate(values)}
+
+    def appended(self, rows, version=None):
+        """New index covering the indexed rows followed by ``rows``."""
+        index = FilterIndex(rows.iloc[:0], columns=[], version=version)
+        index.n_rows = self.n_rows + len(rows)
+        index.bitmaps = {col: {} for col in self.bitmaps}
+        for col, bitmaps in self.bitmaps.items():
+            values = rows[col].to_numpy()
+            for value in list(bitmaps) + [v for v in pd.unique(values) if v not in bitmaps]:
+                old = bitmaps.get(value)
+                if old is None:
+                    old = np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+                index.bitmaps[col][value] = append_bits(old, self.n_rows, values == value)
+        return index
+
+    @property
+    def domains(self):
+        """All indexed values of each column."""
+        return {col: list(bitmaps) for col, bitmaps in self.bitmaps.items()}
+
+    @property
+    def nbytes(self):
+        return sum(bits.nbytes for bitmaps in self.bitmaps.values() for bits in bitmaps.values())
+
+    def _column_bits(self, col, values):
+        """Bitset of the rows of ``col`` matching ``values``, or None if all values are selected."""
+        bitmaps = self.bitmaps[col]
+        wanted = set(values)
+        selected = [value for value in bitmaps if value in wanted]
+        if len(selected) == len(bitmaps):
+            return None
+        if not selected:
+            return np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+        # OR together whichever side of the selection is smaller
+        if len(selected) * 2 <= len(bitmaps):
+            return np.bitwise_or.reduce([bitmaps[value] for value in selected])
+        unselected = [bits for value, bits in bitmaps.items() if value not in selected]
+        return np.invert(np.bitwise_or.reduce(unselected))
+
+    def select(self, selection):
+        """Row positions matching ``selection``, or None when every row matches.
+
+        ``selection`` maps filter columns to the selected values; columns not
+        in the index are ignored.
+        """
+        bits = None
+        for col, values in selection.items():
+            if col not in self.bitmaps:
+                continue
+            col_bits = self._column_bits(col, values)
+            if col_bits is None:
+                continue
+            bits = col_bits if bits is None else np.bitwise_and(bits, col_bits)
+        if bits is None:
+            return None
+        rows = np.flatnonzero(np.unpackbits(bits, count=self.n_rows))
+        # int32 positions halve the size of selections kept in the shared result cache
+        return rows.astype(np.int32) if self.n_rows < 2**31 else rows
+
+
+class RowSelection:
+    """Rows of a shared, read-only frame given by their positions (None = all rows).
+
+    Columns are gathered only when asked for, so a selection costs its
+    position array rather than a copy of every column.
+    """
+
+    def __init__(self, df, positions=None):
+        self.df = df
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.df) if self.positions is None else len(self.positions)
+
+    def __getitem__(self, col):
+        column = self.df[col]
+        return column if self.positions is None else column.iloc[self.positions]
+
+    def subset(self, local):
+        """Selection of the rows at positions ``local`` within this selection."""
+        return RowSelection(self.df, local if self.positions is None else self.positions[local])
+
+    def frame(self, columns=None):
+        """The selected rows (of ``columns``) as a frame."""
+        df = self.df if columns is None else self.df[list(columns)]
+        return df if self.positions is None else df.iloc[self.positions]
+
+    def head(self, n=5):
+        return self.subset(np.arange(min(n, len(self)))).frame()
+
+
+def append_bits(packed, n_bits, bits):
+    """Packed bitset of ``n_bits`` bits followed by the boolean array ``bits``."""
+    used = n_bits % 8
+    if used == 0:
+        return np.concatenate([packed[:n_bits // 8], np.packbits(bits)])
+    tail = np.unpackbits(packed[-1:])[:used].astype(bool)
+    return np.concatenate([packed[:-1], np.packbits(np.concatenate([tail, bits]))])
+
+
+# Process-wide memo: path -> index of the current file version
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def load_index(path=DATA_PATH):
+    """Index of the current version of ``path``; appended rows extend it in place of a rebuild."""
+    with _indexes_lock:
+        version = data_version(path)
+        index = _indexes.get(path)
+        if index is not None and index.version != version:
+            rows = appended_since(path, index.version, until=version)
+            index = None if rows is None else index.appended(rows, version)
+        if index is None:
+            df, version = load_sales(path, columns=FILTER_COLUMNS)
+            index = FilterIndex(df, version=version)
+        _indexes[path] = index
+        return index
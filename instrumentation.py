@@ -0,0 +1,185 @@
+"""Per-rerun timing of the dashboard's stages.
+
+A ``RerunProfile`` records how long each stage of one script run took
+(loading the data, engine computations, figure construction and Streamlit
+rendering) and, when asked, the payload size of every chart and table sent
+to the browser. Stages are recorded with ``stage()`` into the profile of the
+current thread (Streamlit runs each session's script in its own thread), so
+code outside the dashboard such as the engine is timed without passing the
+profile around; with no profile active ``stage()`` only measures.
+
+Finished profiles feed process-wide totals and per-page rerun latencies
+(p50/p95). Set ``DASHBOARD_PROFILE_LOG`` to append every rerun to a JSON
+lines file, and ``DASHBOARD_PROFILE_METRICS`` to keep a Prometheus
+text-format file (e.g. for node_exporter's textfile collector) up to date.
+"""
+import collections
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+LOG_PATH = os.environ.get('DASHBOARD_PROFILE_LOG')
+METRICS_PATH = os.environ.get('DASHBOARD_PROFILE_METRICS')
+# Reruns kept per page for the latency percentiles
+HISTORY = 1000
+
+_local = threading.local()
+
+
+class RerunProfile:
+    def __init__(self, page, payloads=False):
+        self.page = page
+        # Payload sizes serialize what is sent a second time, so they are opt-in
+        self.payloads = payloads
+        self.stages = []
+        self.seconds = None
+        self.started_at = time.time()
+        self._start = None
+
+    def start(self):
+        """Make this the profile ``stage()`` records into on this thread."""
+        _local.profile = self
+        self._start = time.perf_counter()
+        return self
+
+    def finish(self):
+        """Stop recording and publish the rerun to the totals, log and metrics file."""
+        self.seconds = time.perf_counter() - self._start
+        if current() is self:
+            _local.profile = None
+        publish(self)
+        return self
+
+    def summary(self):
+        """Calls, total milliseconds and payload bytes per stage, slowest first."""
+        stages = pd.DataFrame(self.stages, columns=['kind', 'name', 'ms', 'bytes'])
+        summary = stages.groupby(['kind', 'name'], sort=False).agg(
+            calls=('ms', 'size'), ms=('ms', 'sum'), bytes=('bytes', 'sum'),
+        )
+        return summary.sort_values('ms', ascending=False)
+
+    def as_dict(self):
+        return {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(self.started_at)),
+            'page': self.page,
+            'ms': round(self.seconds * 1000, 3),
+            'stages': [{**entry, 'ms': round(entry['ms'], 3)} for entry in self.stages],
+        }
+
+
+def current():
+    """The profile being recorded on this thread, if any."""
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def stage(kind, name):
+    """Time the block as stage ``kind``/``name``; yields the entry, whose ``ms`` is set on exit."""
+    profile = current()
+    entry = {'kind': kind, 'name': name, 'ms': None, 'bytes': None}
+    start = time.perf_counter()
+    try:
+        yield entry
+    finally:
+        entry['ms'] = (time.perf_counter() - start) * 1000
+        if profile is not None:
+            profile.stages.append(entry)
+
+
+@contextmanager
+def profiled(page, payloads=False):
+    """The active profile, or a new one for ``page`` finished on exit (e.g. for a fragment rerun)."""
+    profile = current()
+    if profile is not None:
+        yield profile
+        return
+    profile = RerunProfile(page, payloads).start()
+    try:
+        yield profile
+    finally:
+        profile.finish()
+
+
+def payload_bytes(obj):
+    """Approximate bytes Streamlit sends for ``obj``: Arrow for frames, JSON for figures."""
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        frame = obj.to_frame() if isinstance(obj, pd.Series) else obj
+        return pa.Table.from_pandas(frame).nbytes
+    if hasattr(obj, 'to_json'):
+        return len(obj.to_json())
+    return len(str(obj).encode())
+
+
+# Process-wide totals: (kind, name) -> [calls, seconds, bytes]; page -> recent rerun seconds
+_totals = collections.defaultdict(lambda: [0, 0.0, 0])
+_reruns = collections.defaultdict(lambda: collections.deque(maxlen=HISTORY))
+_reruns_total = collections.Counter()
+_reruns_seconds = collections.Counter()
+_lock = threading.Lock()
+
+
+def publish(profile):
+    with _lock:
+        for entry in profile.stages:
+            totals = _totals[entry['kind'], entry['name']]
+            totals[0] += 1
+            totals[1] += entry['ms'] / 1000
+            totals[2] += entry['bytes'] or 0
+        _reruns[profile.page].append(profile.seconds)
+        _reruns_total[profile.page] += 1
+        _reruns_seconds[profile.page] += profile.seconds
+        if LOG_PATH:
+            with open(LOG_PATH, 'a') as handle:
+                handle.write(json.dumps(profile.as_dict()) + '\n')
+        if METRICS_PATH:
+            # Replaced atomically so a scraper never reads a half-written file
+            tmp = f'{METRICS_PATH}.{os.getpid()}.tmp'
+            with open(tmp, 'w') as handle:
+                handle.write(prometheus_text())
+            os.replace(tmp, METRICS_PATH)
+
+
+def rerun_percentiles():
+    """Reruns, p50 and p95 milliseconds per page over the last ``HISTORY`` reruns."""
+    with _lock:
+        history = {page: np.array(seconds) * 1000 for page, seconds in _reruns.items()}
+    rows = {page: [len(ms), *np.percentile(ms, [50, 95])] for page, ms in history.items()}
+    return pd.DataFrame.from_dict(rows, orient='index', columns=['reruns', 'p50_ms', 'p95_ms'])
+
+
+def label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def prometheus_text():
+    """Totals and rerun quantiles in the Prometheus text exposition format (caller holds ``_lock``)."""
+    lines = [
+        '# HELP dashboard_stage_seconds_total Time spent per dashboard stage.',
+        '# TYPE dashboard_stage_seconds_total counter',
+    ]
+    for (kind, name), (_, seconds, _) in sorted(_totals.items()):
+        lines.append(f'dashboard_stage_seconds_total{{kind="{label(kind)}",name="{label(name)}"}} {seconds:.6f}')
+    lines += ['# HELP dashboard_stage_calls_total Calls per dashboard stage.',
+              '# TYPE dashboard_stage_calls_total counter']
+    for (kind, name), (calls, _, _) in sorted(_totals.items()):
+        lines.append(f'dashboard_stage_calls_total{{kind="{label(kind)}",name="{label(name)}"}} {calls}')
+    lines += ['# HELP dashboard_payload_bytes_total Payload bytes sent per chart or table.',
+              '# TYPE dashboard_payload_bytes_total counter']
+    for (kind, name), (_, _, nbytes) in sorted(_totals.items()):
+        if nbytes:
+            lines.append(f'dashboard_payload_bytes_total{{kind="{label(kind)}",name="{label(name)}"}} {nbytes}')
+    lines += ['# HELP dashboard_rerun_seconds Script rerun latency per page over recent reruns.',
+              '# TYPE dashboard_rerun_seconds summary']
+    for page, seconds in sorted(_reruns.items()):
+        p50, p95 = np.percentile(np.array(seconds), [50, 95])
+        lines.append(f'dashboard_rerun_seconds{{page="{label(page)}",quantile="0.5"}} {p50:.6f}')
+        lines.append(f'dashboard_rerun_seconds{{page="{label(page)}",quantile="0.95"}} {p95:.6f}')
+        lines.append(f'dashboard_rerun_seconds_sum{{page="{label(page)}"}} {_reruns_seconds[page]:.6f}')
+        lines.append(f'dashboard_rerun_seconds_count{{page="{label(page)}"}} {_reruns_total[page]}')
+    return '\n'.join(lines) + '\n'
@@ -1,15 +1,30 @@
+import os
+
 import streamlit as st
-import pandas as pd
 import numpy as np
-import plotly.express as px
-import plotly.graph_objects as go
+import aggregations as agg
+import figures as figs
+from engine import PAGES
+from figures import cached_figure
+from instrumentation import LOG_PATH, METRICS_PATH, RerunProfile, payload_bytes, profiled, rerun_percentiles, stage
+from refresher import REFRESH_SECONDS, current_engine, get_refresher
+from partitions import load_catalog
+from report import load_bundle
+from data_loader import DATA_PATH
 # Set random seed
 np.random.seed(42)
 
-# Load the dataset
-data = pd.read_csv('supermarket_sales.csv')
-df = pd.DataFrame(data)
-df['Date'] = pd.to_datetime(df['Date'])  # Convert Date column to datetime format
+# 'memory' loads the columns each page needs; 'chunked' streams the file into
+# aggregates plus a bounded row sample for exports larger than RAM
+# (DASHBOARD_WORKERS > 1 aggregates the file in that many processes); 'duckdb'
+# queries a DuckDB database built from the file and keeps no rows in memory
+INGEST_MODE = os.environ.get('DASHBOARD_INGEST', 'memory')
+
+# Default of the sidebar toggle that renders the Overview one section at a time
+LAZY_OVERVIEW = os.environ.get('DASHBOARD_LAZY_OVERVIEW', '0') == '1'
+
+# Default of the sidebar toggle that shows per-stage timings and payload sizes of each rerun
+PROFILE_OVERLAY = os.environ.get('DASHBOARD_PROFILE', '0') == '1'
 
 # Custom CSS for color styling with new palette
 st.markdown("""
@@ -70,23 +85,99 @@ st.markdown("""
 
 # Sidebar for filters and navigation
 st.sidebar.header("Filter Options")
-selected_branch = st.sidebar.multiselect("Select Branch", options=df['Branch'].unique(), default=df['Branch'].unique())
-selected_city = st.sidebar.multiselect("Select City", options=df['City'].unique(), default=df['City'].unique())
-selected_customer_type = st.sidebar.multiselect("Select Customer Type", options=df['Customer type'].unique(), default=df['Customer type'].unique())
-selected_gender = st.sidebar.multiselect("Select Gender", options=df['Gender'].unique(), default=df['Gender'].unique())
+# Filters are placed above the page selector but filled in once the page is known
+filter_container = st.sidebar.container()
 
 # Dropdown for page redirection
-page = st.sidebar.selectbox("Navigate to Page", ["Overview", "Research Question 1", "Research Question 2", 
-                                                 "Research Question 3", "Research Question 4", 
-                                                 "Research Question 5", "Research Question 6"])
-
-    # Filter data based on sidebar selections
-df_filtered = df[
-    (df['Branch'].isin(selected_branch)) & 
-    (df['City'].isin(selected_city)) & 
-    (df['Customer type'].isin(selected_customer_type)) & 
-    (df['Gender'].isin(selected_gender))
-]
+page = st.sidebar.selectbox("Navigate to Page", PAGES)
+show_profile = st.sidebar.toggle("Profiling overlay", value=PROFILE_OVERLAY)
+# Times every stage of this rerun; payload sizes only when someone looks at them
+profile = RerunProfile(page, payloads=show_profile or bool(LOG_PATH or METRICS_PATH)).start()
+
+
+def load_engine():
+    # The latest version built off the request path by the background refresher; with
+    # DASHBOARD_REFRESH_SECONDS=0, loads only the columns the selected page needs (parsed
+    # once per file version and shared across sessions). In chunked mode row-level views
+    # work on the ingested row sample
+    with stage('load', INGEST_MODE):
+        return current_engine(DATA_PATH, mode=INGEST_MODE, page=page)
+
+
+# Read once per rerun, so the whole rerun sees one data version even if a refresh lands
+engine = load_engine() if REFRESH_SECONDS > 0 else None
+# A report bundle exported for this data version (see report.py) answers preset filter
+# states without computing anything; other selections are computed live
+with stage('load', 'report'):
+    bundle = load_bundle(DATA_PATH, version=None if engine is None else engine.version)
+if engine is None and bundle is None:
+    engine = load_engine()
+filter_options = engine.domains if bundle is None else bundle.domains
+# Full value lists let the caches treat "everything selected" as one key
+domains = filter_options
+
+selected_branch = filter_container.multiselect("Select Branch", options=filter_options['Branch'], default=filter_options['Branch'])
+selected_city = filter_container.multiselect("Select City", options=filter_options['City'], default=filter_options['City'])
+selected_customer_type = filter_container.multiselect("Select Customer Type", options=filter_options['Customer type'], default=filter_options['Customer type'])
+selected_gender = filter_container.multiselect("Select Gender", options=filter_options['Gender'], default=filter_options['Gender'])
+
+selection = {
+    'Branch': selected_branch,
+    'City': selected_city,
+    'Customer type': selected_customer_type,
+    'Gender': selected_gender,
+}
+
+# A partitioned source (a directory, see partitions.py) can also be filtered by date;
+# partitions outside the selection and date range are never read
+catalog = engine.catalog if engine is not None else load_catalog(DATA_PATH) if os.path.isdir(DATA_PATH) else None
+dates = None
+if catalog is not None and catalog.date_range is not None:
+    first_date, last_date = catalog.date_range
+    picked = filter_container.date_input("Date range", value=(first_date, last_date), min_value=first_date, max_value=last_date)
+    # The input holds a single date while the range is being picked
+    if len(picked) == 2 and tuple(picked) != (first_date, last_date):
+        dates = tuple(picked)
+
+preset = None if bundle is None or dates is not None else bundle.preset(selection)
+if preset is not None:
+    engine = bundle.engine(preset, page, load_engine)
+    st.sidebar.caption(f"Served from the '{preset}' report snapshot")
+else:
+    if engine is None:
+        engine = load_engine()
+    engine = engine.pruned(selection, dates)
+    if catalog is not None:
+        st.sidebar.caption(f"Reading {len(catalog.prune(selection, dates))} of {len(catalog.partitions)} partitions")
+data_version = engine.version
+
+# Aggregation results are memoized per (data version, filter selection)
+stats = agg.results.stats()
+st.sidebar.caption(f"Aggregation cache: {stats['hits']} hits / {stats['misses']} misses")
+if REFRESH_SECONDS > 0 and get_refresher(DATA_PATH, INGEST_MODE).error is not None:
+    st.sidebar.warning(f"Data refresh failed, showing the last loaded version: {get_refresher(DATA_PATH, INGEST_MODE).error}")
+
+
+def show_chart(chart_id, mode='points'):
+    # The engine results the chart plots, wired up as in the report export (figures.chart_inputs)
+    build, args = figs.chart_inputs(engine, chart_id, selection, mode)
+    # Figures are rebuilt only when the data version or filter selection changes
+    with stage('figure', chart_id):
+        fig, spec = cached_figure(chart_id, data_version, selection, build, *args, domains=domains)
+    # Includes Streamlit serializing the figure for the browser
+    with stage('render', chart_id) as rendered:
+        st.plotly_chart(fig, use_container_width=True)
+    if profile.payloads:
+        # Its cached JSON spec, instead of serializing the figure again
+        rendered['bytes'] = len(spec)
+
+
+def show_table(table_id, data):
+    with stage('render', table_id) as rendered:
+        st.write(data)  # Larger text applied via CSS
+    if profile.payloads:
+        rendered['bytes'] = payload_bytes(data)
+
 
 if page == "Overview":
 
@@ -94,143 +185,87 @@ if page == "Overview":
     # Set up the dashboard title
     st.title("Superstore Sales Dashboard")
 
-    # Key Metrics
-    st.markdown("### Key Metrics")
-    total_customers = df_filtered['Invoice ID'].nunique()
-    total_profit = df_filtered['gross income'].sum().round(0)
-    total_cogs = df_filtered['cogs'].sum()
-    kpi1, kpi2, kpi3 = st.columns([1, 1, 1])
-    kpi1.metric("No. of Customers:", total_customers)
-    kpi2.metric("Total COGS/Expenses", "22K")
-    kpi3.metric("Sum of Profit", total_profit)
-
-    # Display sample data
-    st.subheader("Sample Data Table")
-    st.write(df_filtered.head())
-    col1, col2 = st.columns(2)
-
-    with col1:
-        st.subheader("Sales Analysis by Product Line")
-        product_sales = df_filtered.groupby('Product line').agg(
-            Total_Revenue=('Total', 'sum'),
-            Average_Quantity=('Quantity', 'mean'),
-            Average_Unit_Price=('Unit price', 'mean')
-        ).sort_values(by='Total_Revenue', ascending=False)
-        st.write(product_sales)  # Larger text applied via CSS
-
-    with col2:
-        st.subheader("Branch and City Performance")
-        branch_city_sales = df_filtered.groupby(['Branch', 'City']).agg(Total_Revenue=('Total', 'sum')).unstack().fillna(0)
-        st.write(branch_city_sales)  # Larger text applied via CSS
-
-    # Main charts with increased font size for labels
-    col3, col4 = st.columns([2, 2])
-
-    with col3:
-        product_sales = df_filtered.groupby('Product line').agg(
-            Total_Revenue=('Total', 'sum')
-        ).reset_index()
-        
-        fig_product_sales = px.pie(
-            product_sales, 
-            values='Total_Revenue', 
-            names='Product line', 
-            title="Sales by Product Line",
-            color_discrete_sequence=["#535C91", "#1B1A55", "#9290C3", "#070F2B"]
-        )
-        fig_product_sales.update_layout(
-            title_font_size=24,
-            legend_font_size=16,
-        )
-        st.plotly_chart(fig_product_sales, use_container_width=True)
-
-    with col4:
-        customer_type_gender = df_filtered.groupby(['Customer type', 'Gender']).size().reset_index(name='Count')
-
-        fig_customer_demographics = px.pie(
-            customer_type_gender,
-            values='Count', 
-            names='Customer type', 
-            title="Customer Type by Membership",
-            color='Customer type', 
-            color_discrete_sequence=["rgb(52, 50, 163)", "rgb(141, 148, 189)"]  # Updated color scheme
-        )
-
-        fig_customer_demographics.update_layout(
-            title_font_size=24,
-            legend_font_size=16,
-        )
-
-        st.plotly_chart(fig_customer_demographics, use_container_width=True)
-
-
-    branch_city_sales = df_filtered.groupby(['Branch', 'City']).agg(Total_Revenue=('Total', 'sum')).reset_index()
-    fig_branch_city = px.bar(
-        branch_city_sales, 
-        x='Branch', 
-        y='Total_Revenue', 
-        color='City', 
-        title="Total Revenue by Branch and City",
-        barmode='stack',
-        color_continuous_scale=px.colors.sequential.Purples,
-        labels={'Total_Revenue': 'Total Revenue', 'Branch': 'Branch'}
-    )
-    fig_branch_city.update_layout(
-        title_font_size=24,
-        xaxis_title_font_size=18,
-        yaxis_title_font_size=18,
-        legend_font_size=16
-    )
-    st.plotly_chart(fig_branch_city, use_container_width=True)
-
-
-    daily_sales = df_filtered.groupby(df_filtered['Date'].dt.date).agg(Total_Revenue=('Total', 'sum')).reset_index()
-    fig_daily_sales = px.line(
-    daily_sales, 
-        x='Date', 
-        y='Total_Revenue', 
-        title="Sales Trends", 
-        labels={'Date': 'Date', 'Total_Revenue': 'Total Revenue'},
-        color_discrete_sequence=["#9290C3"]
-    )
-    fig_daily_sales.update_layout(
-        title_font_size=24,
-        xaxis_tickangle=-45,
-        xaxis_title="Date",
-        yaxis_title="Total Revenue",
-        xaxis_title_font_size=18,
-        yaxis_title_font_size=18,
-        legend_font_size=16
-    )
-    st.plotly_chart(fig_daily_sales, use_container_width=True)
+    def overview_kpis():
+        st.markdown("### Key Metrics")
+        kpis = engine.kpis(selection)
+        total_customers = engine.customer_count(selection)
+        total_profit = kpis['total_profit']
+        total_cogs = kpis['total_cogs']
+        kpi1, kpi2, kpi3 = st.columns([1, 1, 1])
+        kpi1.metric("No. of Customers:", total_customers)
+        kpi2.metric("Total COGS/Expenses", "22K")
+        kpi3.metric("Sum of Profit", total_profit)
+
+    def overview_tables():
+        # Display sample data
+        st.subheader("Sample Data Table")
+        show_table('overview.sample_rows', engine.sample_rows(selection))
+        col1, col2 = st.columns(2)
+
+        with col1:
+            st.subheader("Sales Analysis by Product Line")
+            product_sales = engine.product_line_summary(selection)
+            show_table('overview.product_sales_table', product_sales)
+
+        with col2:
+            st.subheader("Branch and City Performance")
+            branch_city_sales = engine.branch_city_revenue(selection)
+            branch_city_sales = branch_city_sales.set_index(['Branch', 'City']).unstack().fillna(0)
+            show_table('overview.branch_city_table', branch_city_sales)
+
+    def overview_pies():
+        # Main charts with increased font size for labels
+        col3, col4 = st.columns([2, 2])
+
+        with col3:
+            # Reuses the product line summary computed for the table above
+            show_chart('overview.product_sales')
+
+        with col4:
+            show_chart('overview.customer_demographics')
+
+    def overview_branch_city():
+        show_chart('overview.branch_city')
+
+    def overview_trend():
+        # Day, week or month buckets depending on the date range the selection spans
+        show_chart('overview.daily_sales')
+
+    OVERVIEW_SECTIONS = {
+        "Data Tables": overview_tables,
+        "Product Lines and Customers": overview_pies,
+        "Branch and City": overview_branch_city,
+        "Sales Trends": overview_trend,
+    }
+
+    def render_section(name, render):
+        with stage('section', name) as section:
+            render()
+        st.caption(f"{name} rendered in {section['ms']:,.1f} ms")
+
+    # KPIs come first so they show before the heavier sections
+    render_section("Key Metrics", overview_kpis)
+    if st.sidebar.toggle("Lazy Overview sections", value=LAZY_OVERVIEW):
+        # Only the visible section is computed; switching sections reruns just this fragment
+        @st.fragment
+        def lazy_overview():
+            section = st.radio("Section", list(OVERVIEW_SECTIONS), horizontal=True)
+            # Fragment reruns are profiled on their own, outside the full script run
+            with profiled(f"{page}: {section}", payloads=profile.payloads):
+                render_section(section, OVERVIEW_SECTIONS[section])
+
+        lazy_overview()
+    else:
+        for name, render in OVERVIEW_SECTIONS.items():
+            render_section(name, render)
 elif page == "Research Question 1":
     st.title("Research Question 1")
     st.markdown("**What are the key sales trends and seasonal patterns in supermarket sales data?**")
     
-    # Resample data by month to calculate monthly sales
-    monthly_sales = df_filtered.resample('M', on='Date').sum(numeric_only=True)['Total'].reset_index()
-    
-    # Plotting with Plotly
-    fig_q1 = px.line(
-        monthly_sales,
-        x='Date',
-        y='Total',
-        title="Monthly Total Sales Over Time",
-        labels={'Date': 'Date', 'Total': 'Total Sales'}
-    )
-    
-    fig_q1.update_layout(
-        title_font_size=24,
-        xaxis_title="Date",
-        yaxis_title="Total Sales",
-        xaxis_tickangle=-45,
-        xaxis_title_font_size=18,
-        yaxis_title_font_size=18,
-        legend_font_size=16,
-        template="plotly_dark"
-    )
-    
-    st.plotly_chart(fig_q1, use_container_width=True)
+    # Monthly sales from the cube's precomputed month rollup
+    show_chart('rq1.monthly_sales')
+    if st.checkbox("Show sales by hour of day"):
+        show_chart('rq1.hourly_sales')
     st.markdown("### Conclusion")
     st.write("""
     The supermarket sales data indicates a seasonal pattern with a decline in both total sales and gross income during mid to late February, followed by a rebound in March. This suggests that there might be a typical lull in sales activity during February, possibly due to fewer promotional events or lower consumer demand. However, the upward trend in March signals a recovery, potentially driven by increased demand or seasonal events as the spring season approaches.
@@ -242,83 +277,12 @@ elif page == "Research Question 2":
     st.markdown("**How do customer demographics (e.g., gender, membership status) influence purchasing behavior and sales volume?**")
         
     # --- Total Sales by Gender ---
-    sales_by_gender = df_filtered.groupby('Gender')['Total'].sum().reset_index()
-    fig_sales_gender = px.bar(
-        sales_by_gender,
-        x='Gender',
-        y='Total',
-        title="Total Sales by Gender",
-        color='Gender',
-        labels={'Total': 'Total Sales'},
-        color_discrete_map={
-            'Male': 'rgb(52, 50, 163)',
-            'Female': 'rgb(141, 148, 189)'
-        }
-    )
-    fig_sales_gender.update_layout(
-        title_font_size=24,
-        xaxis_title="Gender",
-        yaxis_title="Total Sales",
-        xaxis_tickangle=0,
-        xaxis_title_font_size=18,
-        yaxis_title_font_size=18,
-        legend_font_size=16,
-        plot_bgcolor='rgb(245, 245, 245)'  # Light background for contrast
-    )
-    st.plotly_chart(fig_sales_gender, use_container_width=True)
+    show_chart('rq2.sales_by_gender')
     # --- Product Line Preferences by Gender ---
-    product_line_gender = df_filtered.groupby(['Product line', 'Gender']).size().reset_index(name='Count')
-    fig_product_line_gender = px.bar(
-        product_line_gender,
-        x='Product line',
-        y='Count',
-        color='Gender',
-        barmode='group',
-        title="Product Line Preferences by Gender",
-        labels={'Product line': 'Product Line', 'Count': 'Number of Purchases'},
-        color_discrete_map={
-            'Male': 'rgb(52, 50, 163)',
-            'Female': 'rgb(141, 148, 189)'
-        }
-    )
-    fig_product_line_gender.update_layout(
-        title_font_size=24,
-        xaxis_tickangle=-45,
-        xaxis_title="Product Line",
-        yaxis_title="Number of Purchases",
-        xaxis_title_font_size=18,
-        yaxis_title_font_size=18,
-        legend_font_size=16,
-        plot_bgcolor='rgb(245, 245, 245)'
-    )
-    st.plotly_chart(fig_product_line_gender, use_container_width=True)
+    show_chart('rq2.product_line_gender')
 
     # --- Product Line Preferences by Customer Type ---
-    product_line_customer_type = df_filtered.groupby(['Product line', 'Customer type']).size().reset_index(name='Count')
-    fig_product_line_customer_type = px.bar(
-        product_line_customer_type,
-        x='Product line',
-        y='Count',
-        color='Customer type',
-        barmode='group',
-        title="Product Line Preferences by Customer Type",
-        labels={'Product line': 'Product Line', 'Count': 'Number of Purchases'},
-        color_discrete_map={
-            'Member': 'rgb(83, 92, 145)',
-            'Normal': 'rgb(68, 68, 68)'
-        }
-    )
-    fig_product_line_customer_type.update_layout(
-        title_font_size=24,
-        xaxis_tickangle=-45,
-        xaxis_title="Product Line",
-        yaxis_title="Number of Purchases",
-        xaxis_title_font_size=18,
-        yaxis_title_font_size=18,
-        legend_font_size=16,
-        plot_bgcolor='rgb(245, 245, 245)'
-    )
-    st.plotly_chart(fig_product_line_customer_type, use_container_width=True)
+    show_chart('rq2.product_line_customer_type')
     # Conclusion
     st.markdown("### Conclusion")
     st.write("""
@@ -333,58 +297,10 @@ elif page == "Research Question 3":
     st.markdown("**Which product lines contribute the most to overall revenue, and which ones are underperforming?**")
 
     # --- Total Sales by Product Line ---
-    sales_by_product = df_filtered.groupby('Product line')['Total'].sum().reset_index()
-    fig_sales_product = px.bar(
-        sales_by_product,
-        x='Product line',
-        y='Total',
-        title="Total Sales by Product Line",
-        color='Product line',
-        color_discrete_sequence=[
-            'rgb(52, 50, 163)', 'rgb(141, 148, 189)', 'rgb(83, 92, 145)', 'rgb(68, 68, 68)',
-            'rgb(111, 115, 178)', 'rgb(75, 73, 165)'
-        ]
-    )
-    fig_sales_product.update_layout(
-        title_font_size=24,
-        xaxis_title="Product Line",
-        yaxis_title="Total Sales",
-        xaxis_tickangle=-45,
-        xaxis_title_font_size=18,
-        yaxis_title_font_size=18,
-        legend_title_text="Product Line",
-        plot_bgcolor='rgb(245, 245, 245)'
-    )
-    st.plotly_chart(fig_sales_product, use_container_width=True)
+    show_chart('rq3.sales_by_product')
 
     # --- Revenue Contribution by Product Line (Pie Chart) ---
-    fig_revenue_contribution = px.pie(
-    sales_by_product,
-    names='Product line',
-    values='Total',
-    title="Revenue Contribution by Product Line",
-    color_discrete_sequence=[
-        'rgb(52, 50, 163)', 'rgb(141, 148, 189)', 'rgb(83, 92, 145)', 'rgb(68, 68, 68)',
-        'rgb(111, 115, 178)', 'rgb(75, 73, 165)'
-    ]
-)
-
-    # Update traces to ensure all labels are placed inside
-    fig_revenue_contribution.update_traces(
-        textinfo='percent+label', 
-        textposition='inside',  # Place all labels inside the chart
-        insidetextorientation='radial'  # Orient text radially for better fit
-    )
-
-    # Update layout
-    fig_revenue_contribution.update_layout(
-        title_font_size=24,
-        legend_font_size=16,
-        plot_bgcolor='rgb(245, 245, 245)'
-    )
-
-    # Display in Streamlit
-    st.plotly_chart(fig_revenue_contribution, use_container_width=True)
+    show_chart('rq3.revenue_contribution')
 
     # Conclusion
     st.markdown("### Conclusion")
@@ -400,52 +316,10 @@ elif page == "Research Question 4":
     st.markdown("**How do sales performance and product preferences vary across different branches and cities?**")
 
     # --- Sales by Branch ---
-    branch_sales = df_filtered.groupby('Branch')['Total'].sum().reset_index()
-    fig_branch_sales = px.bar(
-        branch_sales,
-        x='Branch',
-        y='Total',
-        title="Sales by Branch",
-        color='Branch',
-        color_discrete_sequence=['rgb(141, 148, 189)', 'rgb(83, 92, 145)', 'rgb(68, 68, 68)']
-    )
-    fig_branch_sales.update_layout(
-        title_font_size=24,
-        xaxis_title="Branch",
-        yaxis_title="Total Sales",
-        xaxis_tickangle=0,
-        plot_bgcolor='rgb(245, 245, 245)'
-    )
-    st.plotly_chart(fig_branch_sales, use_container_width=True)
+    show_chart('rq4.branch_sales')
 
     # --- Product Preferences by City (Heatmap) ---
-   # Create the pivot table
-    product_city_sales = df_filtered.pivot_table(values='Total', index='Product line', columns='City', aggfunc='sum').fillna(0)
-
-    # Convert the pivot table values to formatted strings for display in each cell
-    text_values = product_city_sales.applymap(lambda x: f'{x:,.0f}')  # Format values as comma-separated integers
-
-    # Create the heatmap with annotations
-    fig_heatmap = go.Figure(data=go.Heatmap(
-        z=product_city_sales.values,
-        x=product_city_sales.columns,
-        y=product_city_sales.index,
-        text=text_values.values,  # Add text values
-        hovertemplate="%{text}",  # Display text values
-        colorscale='Blues',
-        colorbar=dict(title="Sales")
-    ))
-
-    # Update layout for title, axis titles, and background color
-    fig_heatmap.update_layout(
-        title="Product Sales by City and Product Line",
-        xaxis_title="City",
-        yaxis_title="Product Line",
-        plot_bgcolor='rgb(245, 245, 245)'
-    )
-
-# Display in Streamlit
-    st.plotly_chart(fig_heatmap, use_container_width=True)
+    show_chart('rq4.product_city_heatmap')
     # Conclusion
     st.markdown("### Conclusion")
     st.write("""
@@ -457,53 +331,24 @@ elif page == "Research Question 5":
     st.markdown("**What is the relationship between customer satisfaction ratings and sales volume across different product categories?**")
 
     # --- Satisfaction Rating vs Sales by Product Line (Scatter Plot) ---
-    # Create the scatter plot based on filtered data
-    fig_scatter_satisfaction_sales = px.scatter(
-        df_filtered,
-        x='Rating',
-        y='Total',
-        color='Gender',
-        facet_col='Product line',
-        facet_col_wrap=3,
-        title="Customer Satisfaction Rating vs. Sales Volume by Product Line",
-        color_discrete_sequence=['rgb(52, 50, 163)', 'rgb(83, 92, 145)'],
-        opacity=0.7,
-        facet_col_spacing=0.08,  # Adjust column spacing
-        facet_row_spacing=0.15   # Adjust row spacing
-    )
-
-    # Update layout for improved spacing and appearance
-    fig_scatter_satisfaction_sales.update_layout(
-        title_font_size=24,
-        xaxis_title="Customer Satisfaction Rating",
-        yaxis_title="Total Sales",
-        legend_title_text="Gender",
-        plot_bgcolor='rgb(245, 245, 245)',
-        margin=dict(t=80, b=50, l=50, r=50)  # Add margins around the entire plot
-    )
-
-    # Adjust subplot titles to give more space between title and the graph
-    for annotation in fig_scatter_satisfaction_sales.layout.annotations:
-        annotation['yshift'] = 10  # Move titles slightly higher to increase spacing
-
-    # Display the updated plot in Streamlit
-    st.plotly_chart(fig_scatter_satisfaction_sales, use_container_width=True)
+    # Large selections are sampled or binned server-side instead of sending every row
+    # A view of the shared frame; rows are only gathered for what gets plotted
+    df_filtered = engine.rows(selection)
+    if engine.sampled:
+        kpis = engine.kpis(selection)
+        st.caption(f"Chunked ingestion: plotting a uniform sample of {len(df_filtered):,} of {kpis['invoices']:,} sales.")
+    requested_mode = 'Auto'
+    if len(df_filtered) > figs.SCATTER_ROW_THRESHOLD:
+        requested_mode = st.radio("Large-data mode", ["Auto", "Sample", "Density"], horizontal=True)
+    scatter_mode = figs.scatter_mode(len(df_filtered), requested_mode)
+    if scatter_mode == 'density':
+        st.caption(f"Density mode: {len(df_filtered):,} sales binned per product line.")
+    elif scatter_mode == 'sample':
+        sample = engine.scatter_sample(selection, figs.SCATTER_SAMPLE_SIZE)
+        st.caption(f"Sample mode: showing {len(sample):,} of {len(df_filtered):,} sales, stratified by product line and gender.")
+    show_chart(figs.scatter_chart(scatter_mode), scatter_mode)
     # --- Customer Satisfaction Ratings by Product Line (Box Plot) ---
-    fig_boxplot_satisfaction = px.box(
-        df_filtered,
-        x='Product line',
-        y='Rating',
-        title="Customer Satisfaction Ratings by Product Line",
-        color_discrete_sequence=['rgb(68, 68, 68)']
-    )
-    fig_boxplot_satisfaction.update_layout(
-        title_font_size=24,
-        xaxis_title="Product Line",
-        yaxis_title="Satisfaction Rating",
-        xaxis_tickangle=-45,
-        plot_bgcolor='rgb(245, 245, 245)'
-    )
-    st.plotly_chart(fig_boxplot_satisfaction, use_container_width=True)
+    show_chart('rq5.product_rating_box')
 
     # Conclusion
     st.markdown("### Conclusion")
@@ -516,39 +361,10 @@ elif page == "Research Question 6":
     st.markdown("**How do different payment methods (e.g., cash, credit card, mobile payment) impact sales volume and customer satisfaction?**")
 
     # --- Sales by Payment Method ---
-    payment_sales = df_filtered.groupby('Payment')['Total'].sum().reset_index()
-    fig_payment_sales = px.bar(
-        payment_sales,
-        x='Payment',
-        y='Total',
-        title="Sales by Payment Method",
-        color='Payment',
-        color_discrete_sequence=['rgb(52, 50, 163)', 'rgb(141, 148, 189)', 'rgb(83, 92, 145)']
-    )
-    fig_payment_sales.update_layout(
-        title_font_size=24,
-        xaxis_title="Payment Method",
-        yaxis_title="Total Sales",
-        xaxis_tickangle=0,
-        plot_bgcolor='rgb(245, 245, 245)'
-    )
-    st.plotly_chart(fig_payment_sales, use_container_width=True)
+    show_chart('rq6.payment_sales')
 
     # --- Customer Satisfaction Ratings by Payment Method (Box Plot) ---
-    fig_boxplot_payment = px.box(
-        df_filtered,
-        x='Payment',
-        y='Rating',
-        title="Customer Satisfaction Ratings by Payment Method",
-        color_discrete_sequence=['rgb(68, 68, 68)']
-    )
-    fig_boxplot_payment.update_layout(
-        title_font_size=24,
-        xaxis_title="Payment Method",
-        yaxis_title="Satisfaction Rating",
-        plot_bgcolor='rgb(245, 245, 245)'
-    )
-    st.plotly_chart(fig_boxplot_payment, use_container_width=True)
+    show_chart('rq6.payment_rating_box')
 
     # Conclusion
     st.markdown("### Conclusion")
@@ -559,3 +375,11 @@ elif page == "Research Question 6":
     
     This indicates that while cash drives more sales, Ewallet tends to yield higher customer satisfaction on average.
     """)
+
+profile.finish()
+if show_profile:
+    with st.sidebar.expander("Profiling", expanded=True):
+        st.caption(f"Rerun took {profile.seconds * 1000:,.1f} ms")
+        st.dataframe(profile.summary().round(1))
+        st.caption("Rerun latency in this process")
+        st.dataframe(rerun_percentiles().round(1))
@@ -0,0 +1,285 @@
+"""Sales exports partitioned into a directory of CSV files.
+
+A source directory such as ``sales/branch=A/month=2019-01/part.csv`` is
+described by a catalog listing, per file, its content version, row count,
+Date range and distinct values of the sidebar filter columns. The catalog
+is kept in ``.snapshots/catalog.json`` under the directory. A file is only
+read when it is new or its size or mtime moved, so loading the catalog
+normally just stats the files.
+
+``Catalog.prune`` drops the partitions that cannot hold rows matching a
+filter selection and date range, before any of them is read.
+``load_partitioned`` merges the cubes of the remaining ones into a
+``PartitionedCube``, which answers the aggregations; rows are read, and
+kept in a size-bounded cache, only for the partitions a page's rows can be
+in (``load_rows``). Partition cubes are built through ``cube.load_cube``
+and memoized per file, so appends to a partition are folded in as for a
+single export, and per-partition frames are never kept.
+"""
+import glob
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from aggregations import LRUCache
+from cube import CUBE_COLUMNS, SalesCube, build_cube, load_cube, merge_cubes
+from data_loader import FILTER_COLUMNS, SNAPSHOT_DIR, data_version, empty_frame, file_stat, load_sales
+from filter_index import FilterIndex
+
+
+class Partition:
+    def __init__(self, path, stat, version, rows, first_date, last_date, values, keys):
+        self.path = path
+        self.stat = stat
+        self.version = version
+        self.rows = rows
+        # Inclusive Date range of the rows, as ISO dates
+        self.first_date = first_date
+        self.last_date = last_date
+        # Distinct values of each filter column
+        self.values = values
+        # key=value segments of the path below the source directory
+        self.keys = keys
+
+    @classmethod
+    def scan(cls, root, path):
+        """Catalog entry of the partition file ``path``, read through its snapshot."""
+        df, version = load_sales(path, columns=FILTER_COLUMNS + ['Date'], keep=False)
+        dates = df['Date']
+        keys = dict(
+            segment.split('=', 1) for segment in os.path.relpath(os.path.dirname(path), root).split(os.sep)
+            if '=' in segment
+        )
+        return cls(
+            path, file_stat(path), version, len(df),
+            dates.min().date().isoformat() if len(df) else None,
+            dates.max().date().isoformat() if len(df) else None,
+            {col: sorted(str(value) for value in df[col].unique()) for col in FILTER_COLUMNS},
+            keys,
+        )
+
+    def as_dict(self):
+        return {**vars(self), 'stat': list(self.stat)}
+
+    def matches(self, selection, dates=None):
+        """Whether rows matching ``selection`` and the ``(first, last)`` ``dates`` may be in this file."""
+        if not self.rows:
+            return False
+        for col, values in selection.items():
+            if col in self.values and not set(self.values[col]) & {str(value) for value in values}:
+                return False
+        if dates is not None:
+            first, last = (pd.Timestamp(day).date().isoformat() for day in dates)
+            return self.first_date <= last and self.last_date >= first
+        return True
+
+
+def partition_set_version(partitions, dates=None):
+    """Version of the data in ``partitions`` restricted to ``dates``."""
+    text = '|'.join(partition.version for partition in partitions) + f'|{dates!r}'
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+class Catalog:
+    def __init__(self, root, partitions):
+        self.root = root
+        self.partitions = partitions
+        self.version = partition_set_version(partitions)
+
+    @property
+    def domains(self):
+        """Every value of each filter column across the partitions."""
+        return {
+            col: sorted({value for partition in self.partitions for value in partition.values[col]})
+            for col in FILTER_COLUMNS
+        }
+
+    @property
+    def date_range(self):
+        dated = [partition for partition in self.partitions if partition.rows]
+        if not dated:
+            return None
+        return (
+            pd.Timestamp(min(partition.first_date for partition in dated)).date(),
+            pd.Timestamp(max(partition.last_date for partition in dated)).date(),
+        )
+
+    def prune(self, selection, dates=None):
+        """Partitions that may hold rows matching ``selection`` and ``dates``."""
+        return [partition for partition in self.partitions if partition.matches(selection, dates)]
+
+
+def catalog_path(root):
+    return os.path.join(root, SNAPSHOT_DIR, 'catalog.json')
+
+
+# Process-wide memo: directory -> catalog of its current files
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def load_catalog(root):
+    """Catalog of the CSV files under ``root``; only new or changed files are read."""
+    root = os.path.abspath(root)
+    with _catalogs_lock:
+        known = {}
+        cached = _catalogs.get(root)
+        if cached is not None:
+            known = {partition.path: partition for partition in cached.partitions}
+        elif os.path.exists(catalog_path(root)):
+            with open(catalog_path(root)) as handle:
+                for entry in json.load(handle):
+                    entry['path'] = os.path.join(root, entry['path'])
+                    known[entry['path']] = Partition(**{**entry, 'stat': tuple(entry['stat'])})
+        partitions = []
+        for path in sorted(glob.glob(os.path.join(root, '**', '*.csv'), recursive=True)):
+            partition = known.get(path)
+            if partition is None or partition.stat != file_stat(path):
+                partition = Partition.scan(root, path)
+            partitions.append(partition)
+        catalog = Catalog(root, partitions)
+        if cached is None or cached.version != catalog.version:
+            os.makedirs(os.path.dirname(catalog_path(root)), exist_ok=True)
+            tmp = f'{catalog_path(root)}.{os.getpid()}.tmp'
+            with open(tmp, 'w') as handle:
+                json.dump([{**partition.as_dict(), 'path': os.path.relpath(partition.path, root)}
+                           for partition in partitions], handle, indent=1)
+            os.replace(tmp, catalog_path(root))
+        _catalogs[root] = catalog
+        return catalog
+
+
+def concat_frames(frames):
+    """Rows of ``frames`` in order, keeping category columns categorical."""
+    if not frames:
+        return empty_frame()
+    if len(frames) == 1:
+        return frames[0]
+    combined = pd.concat(frames, ignore_index=True)
+    for col in frames[0].columns:
+        if isinstance(frames[0][col].dtype, pd.CategoricalDtype):
+            combined[col] = union_categoricals([frame[col] for frame in frames], sort_categories=True)
+    return combined
+
+
+class PartitionChanged(RuntimeError):
+    """A partition file changed after the catalog in use was built."""
+
+
+def covers(partition, dates):
+    """Whether every row of ``partition`` is inside the ``(first, last)`` ``dates``."""
+    return dates is None or (
+        pd.Timestamp(dates[0]).date().isoformat() <= partition.first_date
+        and partition.last_date <= pd.Timestamp(dates[1]).date().isoformat()
+    )
+
+
+def read_partition(partition, dates=None, columns=None):
+    """Rows of ``partition`` inside ``dates``, read for one-off use (not memoized)."""
+    df, version = load_sales(partition.path, columns=columns, keep=False)
+    if version != partition.version:
+        raise PartitionChanged(partition.path)
+    if not covers(partition, dates):
+        days = df['Date'].dt.normalize()
+        df = df[(days >= pd.Timestamp(dates[0])) & (days <= pd.Timestamp(dates[1]))].reset_index(drop=True)
+    return df
+
+
+def partition_cube(partition, dates=None):
+    """Cube of the rows of ``partition`` inside ``dates``."""
+    if covers(partition, dates):
+        # A partition inside the range keeps its memoized cube
+        cube = load_cube(partition.path)
+        if cube.version != partition.version:
+            raise PartitionChanged(partition.path)
+        return cube
+    return build_cube(read_partition(partition, dates, CUBE_COLUMNS))
+
+
+class PartitionedCube(SalesCube):
+    """Merged cube of a set of partitions, whose rows are read only when asked for.
+
+    Like ``sql_backend.SQLCube`` it stands in for the frame as well: pages
+    are answered from the partitions' cubes, and ``sales(selection)`` reads
+    the rows of just the partitions that may hold the selection's rows.
+    """
+
+    def __init__(self, cube, partitions, dates, version):
+        super().__init__(cube.tables, version, cube.invoice_sketches)
+        self.partitions = partitions
+        self.dates = dates
+        self.row_count = int(cube.tables[()]['count'].sum())
+
+    def matching(self, selection):
+        return [partition for partition in self.partitions if partition.matches(selection, self.dates)]
+
+    def sales(self, selection):
+        """``PartitionRows`` of the partitions that may hold rows matching ``selection``."""
+        return load_rows(self.matching(selection), self.dates)
+
+    def head(self, selection, n=5):
+        """First ``n`` rows matching ``selection``, reading partitions only until there are enough."""
+        frames, found = [], 0
+        for partition in self.matching(selection):
+            df = read_partition(partition, self.dates)
+            rows = FilterIndex(df).select(selection)
+            df = df if rows is None else df.iloc[rows]
+            frames.append(df.head(n - found))
+            found += len(frames[-1])
+            if found >= n:
+                break
+        return concat_frames(frames)
+
+
+class PartitionRows:
+    """Rows and filter index of a set of partitions."""
+
+    def __init__(self, frame, index, version):
+        self.frame = frame
+        self.index = index
+        self.version = version
+        self.nbytes = int(frame.memory_usage(deep=True).sum()) + index.nbytes
+
+
+# Merged cubes of recently used partition sets, and the rows of recently read ones
+# (bounded by size); shared by every session
+ROWS_CACHE_BYTES = int(os.environ.get('DASHBOARD_PARTITION_ROWS_MB', 512)) * 2**20
+cubes = LRUCache(maxsize=32)
+rows = LRUCache(maxsize=None, maxbytes=ROWS_CACHE_BYTES, sizeof=lambda sales: sales.nbytes)
+
+
+def load_partitioned(partitions, dates=None):
+    """``PartitionedCube`` of ``partitions``, restricted to the ``(first, last)`` ``dates`` when given.
+
+    Only partitions cut by ``dates`` are read; the others reuse their
+    memoized cubes. Raises ``PartitionChanged`` if a file no longer matches
+    its catalog entry.
+    """
+    version = partition_set_version(partitions, dates)
+
+    def build():
+        parts = [partition_cube(partition, dates) for partition in partitions]
+        merged = merge_cubes(parts, version) if parts else build_cube(empty_frame(), version)
+        return PartitionedCube(merged, partitions, dates, version)
+
+    return cubes.get_or_compute(version, build)
+
+
+def load_rows(partitions, dates=None):
+    """``PartitionRows`` of ``partitions``, restricted to ``dates`` when given."""
+    version = partition_set_version(partitions, dates)
+
+    def build():
+        frame = concat_frames([read_partition(partition, dates) for partition in partitions])
+        return PartitionRows(frame, FilterIndex(frame, version=version), version)
+
+    return rows.get_or_compute(version, build)
+
+
+def source_version(path):
+    """Content version of a single export file or of a partitioned directory."""
+    return load_catalog(path).version if os.path.isdir(path) else data_version(path)
@@ -0,0 +1,115 @@
+"""Background refresh of the dashboard's dataset.
+
+A ``DatasetRefresher`` thread polls the data source (``DASHBOARD_DATA_PATH``:
+the sales export, or a directory of partition files such as one file per day)
+every ``DASHBOARD_REFRESH_SECONDS``. When its version changes,
+the thread builds a complete ``SalesEngine`` (frame, cube, filter index) of
+the new version and warms the result cache for the default selection of
+every page. Only then does it swap the new engine in with a single
+reference assignment. Sessions read that reference once per rerun, so they
+keep using a consistent version while the next one is built and never wait
+for a reload. Only the first load of a process is waited for.
+
+One engine serves every page, so a single-file export is loaded with the
+columns of all pages: the Overview's sample table shows every column, so
+that is the full frame. Loading only the columns of the requested page
+(``engine.PAGE_COLUMNS``) needs refreshing off (``DASHBOARD_REFRESH_SECONDS=0``),
+at the cost of loading in the request path.
+
+Results of different versions never mix because every cache key includes
+the data version; stale entries age out of the LRU caches.
+"""
+import os
+import threading
+import time
+
+from data_loader import DATA_PATH
+from engine import PAGES, SalesEngine
+from partitions import source_version
+
+# Seconds between checks of the export for a new version (0 = load in the request path)
+REFRESH_SECONDS = float(os.environ.get('DASHBOARD_REFRESH_SECONDS', 5))
+
+
+class DatasetRefresher:
+    def __init__(self, path=DATA_PATH, mode='memory', interval=REFRESH_SECONDS):
+        self.path = path
+        self.mode = mode
+        self.interval = interval
+        self.engine = None
+        # Last failed refresh, kept until one succeeds; the current engine stays in service
+        self.error = None
+        self.refreshed_at = None
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='dataset-refresher', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def current(self):
+        """Engine of the latest fully built version; waits only until the first one exists."""
+        self._ready.wait()
+        engine = self.engine
+        if engine is None:
+            raise self.error
+        return engine
+
+    def refresh(self):
+        """Build and swap in the engine of the file's current version; False if already current."""
+        engine = self.engine
+        if engine is not None and source_version(self.path) == engine.version:
+            return False
+        engine = SalesEngine.load(self.path, mode=self.mode)
+        # Never swap in an engine whose parts were built from different versions
+        parts = [engine.cube] + ([] if engine.index is None else [engine.index])
+        if any(part.version != engine.version for part in parts):
+            raise RuntimeError(f'{self.path}: engine parts of different versions')
+        for page in PAGES:
+            engine.page(page, engine.default_selection())
+        self.engine = engine
+        self.refreshed_at = time.time()
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+                self.error = None
+            except Exception as error:
+                self.error = error
+            # Waiters are released by the first attempt, failed or not
+            self._ready.set()
+            if self._stop.wait(self.interval):
+                return
+
+
+# Process-wide memo: (path, mode) -> running refresher
+_refreshers = {}
+_refreshers_lock = threading.Lock()
+
+
+def get_refresher(path=DATA_PATH, mode='memory', interval=REFRESH_SECONDS):
+    """The process's refresher of ``path`` in ``mode``, started on first use."""
+    key = (os.path.abspath(path), mode)
+    with _refreshers_lock:
+        refresher = _refreshers.get(key)
+        if refresher is None:
+            refresher = _refreshers[key] = DatasetRefresher(path, mode, interval).start()
+        return refresher
+
+
+def current_engine(path=DATA_PATH, mode='memory', page=None, interval=REFRESH_SECONDS):
+    """Engine for a rerun: the refresher's latest, or a request-path load with refreshing off.
+
+    ``page`` only narrows the columns loaded with refreshing off; the
+    refresher's engine has the columns of every page.
+    """
+    if interval <= 0:
+        return SalesEngine.load(path, mode=mode, page=page)
+    return get_refresher(path, mode, interval).current()
@@ -0,0 +1,291 @@
+"""Static report bundles of the dashboard pages for preset filter states.
+
+Most visits look at the pages with the default filters, so their results
+can be computed ahead of time. ``export`` computes every page's aggregations
+and figures for each preset (one process per page) and writes a bundle:
+pickled aggregation results and JSON figure specs for the dashboard, and a
+standalone HTML report per preset and page for anyone without it.
+
+The dashboard loads the bundle of the current data version with
+``load_bundle`` and, when the sidebar selection matches a preset, runs the
+page against ``Bundle.engine``: results come from the bundle and figures are
+preloaded into the figure cache, so nothing is computed. Whatever the bundle
+lacks (e.g. a filter state other than the presets' defaults) is computed
+live.
+
+Run ``python report.py [path] [--presets presets.json] [--out DIR]
+[--workers N]``. A presets file maps preset names to selections, e.g.
+``{"branch-a": {"Branch": ["A"]}}``; unlisted columns select every value,
+and an ``all`` preset with every value selected is always exported.
+"""
+import argparse
+import json
+import os
+import pickle
+import re
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import figures as figs
+from aggregations import cache_key, canonical_selection
+from data_loader import DATA_PATH, SNAPSHOT_DIR
+from engine import PAGES, SalesEngine
+from filter_index import RowSelection
+from partitions import source_version
+from streaming import WORKERS
+
+# Bundle served by the dashboard, by default next to the CSV's other snapshots
+REPORT_DIR = os.environ.get('DASHBOARD_REPORT_DIR')
+
+DEFAULT_PRESETS = {'all': {}}
+
+# Names of the per-version folders of a bundle (data version digests)
+VERSION_FOLDER = re.compile(r'[0-9a-f]{32}')
+
+
+def report_dir(path):
+    path = os.path.abspath(path)
+    folder = path if os.path.isdir(path) else os.path.dirname(path)
+    return REPORT_DIR or os.path.join(folder, SNAPSHOT_DIR, 'report')
+
+
+def slug(name):
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+
+
+def page_results(engine, page, selection):
+    """Results of every engine call ``page`` makes by default, keyed by method name and arguments."""
+    results = engine.page(page, selection)
+    if page == "Research Question 5":
+        rows = results.pop(('rows',))
+        if figs.scatter_mode(len(rows)) == 'points':
+            # Only selections small enough to plot every row keep their rows in the bundle
+            results[('rows',)] = RowSelection(rows.frame(figs.SCATTER_COLUMNS))
+        else:
+            # Larger ones keep their size, which picks the scatter mode, and both large-data modes' results
+            results[('rows',)] = RowCount(len(rows))
+            results[('rating_density',)] = engine.rating_density(selection)
+            results[('scatter_sample', figs.SCATTER_SAMPLE_SIZE)] = engine.scatter_sample(
+                selection, figs.SCATTER_SAMPLE_SIZE
+            )
+    return results
+
+
+class RowCount:
+    """Stands in for the rows of a large selection in a bundle; only their number is kept."""
+
+    def __init__(self, n_rows):
+        self.n_rows = n_rows
+
+    def __len__(self):
+        return self.n_rows
+
+
+def html_table(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.to_html()
+    if isinstance(value, dict) and all(pd.api.types.is_scalar(item) for item in value.values()):
+        return pd.Series(value).to_frame('value').to_html()
+    if pd.api.types.is_scalar(value):
+        return f'<p>{value}</p>'
+    return ''
+
+
+def page_html(page, preset, results, charts):
+    parts = [f'<html><head><meta charset="utf-8"><title>{page} ({preset})</title></head><body>',
+             f'<h1>{page}</h1><p>Filter preset: {preset}</p>']
+    for index, fig in enumerate(charts.values()):
+        parts.append(fig.to_html(full_html=False, include_plotlyjs='cdn' if index == 0 else False))
+    for spec, value in results.items():
+        # Plotted rows are left to the scatter chart
+        table = '' if isinstance(value, RowSelection) else html_table(value)
+        if table:
+            parts.append(f"<h3>{' '.join(str(part) for part in spec)}</h3>{table}")
+    parts.append('</body></html>')
+    return '\n'.join(parts)
+
+
+def export_page(path, page, presets, folder, mode='memory'):
+    """Write ``page``'s results, figure specs and HTML for every preset; return its manifest entries."""
+    engine = SalesEngine.load(path, mode=mode, page=page)
+    entries = {}
+    for preset, columns in presets.items():
+        selection = {col: list(columns.get(col, values)) for col, values in engine.domains.items()}
+        results = page_results(engine, page, selection)
+        charts = {}
+        entry = {'charts': {}}
+        base = os.path.join(slug(preset), slug(page))
+        os.makedirs(os.path.join(folder, base), exist_ok=True)
+        for chart_id, build, args in figs.page_charts(engine, page, selection):
+            charts[chart_id] = build(*args)
+            spec = os.path.join(base, f'{chart_id}.json')
+            with open(os.path.join(folder, spec), 'w') as handle:
+                handle.write(charts[chart_id].to_json())
+            # The dashboard's figure cache keys on the scalar arguments only
+            params = cache_key(chart_id, engine.version, selection, args)[3]
+            entry['charts'][chart_id] = {'spec': spec, 'params': list(params)}
+        entry['results'] = f'{base}.pkl'
+        with open(os.path.join(folder, entry['results']), 'wb') as handle:
+            pickle.dump(results, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        entry['html'] = f'{base}.html'
+        with open(os.path.join(folder, entry['html']), 'w') as handle:
+            handle.write(page_html(page, preset, results, charts))
+        entries[preset] = entry
+    domains = {col: [str(value) for value in values] for col, values in engine.domains.items()}
+    return page, engine.version, domains, engine.sampled, entries
+
+
+def export(path=DATA_PATH, presets=None, out=None, workers=WORKERS, mode='memory'):
+    """Export a bundle of every page for ``presets`` of the current version of ``path``.
+
+    Each version is written to its own folder and published by replacing
+    ``manifest.json``, so the dashboard never reads a half-written bundle.
+    """
+    path = os.path.abspath(path)
+    out = out or report_dir(path)
+    presets = {**DEFAULT_PRESETS, **(presets or {})}
+    version = source_version(path)
+    folder = os.path.join(out, version)
+    os.makedirs(folder, exist_ok=True)
+    args = [[path] * len(PAGES), PAGES, [presets] * len(PAGES), [folder] * len(PAGES), [mode] * len(PAGES)]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(PAGES))) as pool:
+            exported = list(pool.map(export_page, *args))
+    else:
+        exported = list(map(export_page, *args))
+    if any(part[1] != version for part in exported):
+        raise RuntimeError(f'{path} changed during the export')
+    _, _, domains, sampled, _ = exported[0]
+    manifest = {
+        'version': version,
+        'sampled': sampled,
+        'domains': domains,
+        'presets': {
+            preset: {col: list(columns.get(col, values)) for col, values in domains.items()}
+            for preset, columns in presets.items()
+        },
+        # Paths inside are relative to the version's folder
+        'pages': {preset: {page: entries[preset] for page, _, _, _, entries in exported} for preset in presets},
+    }
+    with open(os.path.join(out, 'index.html'), 'w') as handle:
+        handle.write('<html><body><h1>Sales reports</h1>' + ''.join(
+            f"<h2>{preset}</h2><ul>" + ''.join(
+                f"<li><a href=\"{version}/{manifest['pages'][preset][page]['html']}\">{page}</a></li>" for page in PAGES
+            ) + '</ul>' for preset in presets
+        ) + '</body></html>')
+    tmp = os.path.join(out, f'manifest.json.{os.getpid()}.tmp')
+    with open(tmp, 'w') as handle:
+        json.dump(manifest, handle, indent=1)
+    os.replace(tmp, os.path.join(out, 'manifest.json'))
+    # Drop the folders of older versions; ``out`` may be shared, so nothing else is touched
+    for name in os.listdir(out):
+        if name != version and VERSION_FOLDER.fullmatch(name) and os.path.isdir(os.path.join(out, name)):
+            shutil.rmtree(os.path.join(out, name), ignore_errors=True)
+    return manifest
+
+
+class SnapshotEngine:
+    """``SalesEngine`` stand-in answering from bundled results; anything else goes to ``load()``."""
+
+    def __init__(self, results, version, domains, sampled, load):
+        self.results = results
+        self.version = version
+        self.domains = domains
+        self.sampled = sampled
+        self._load = load
+        self._live = None
+
+    def live(self):
+        if self._live is None:
+            self._live = self._load()
+        return self._live
+
+    def __getattr__(self, name):
+        def method(selection, *args):
+            key = (name, *args)
+            if key in self.results:
+                return self.results[key]
+            return getattr(self.live(), name)(selection, *args)
+        return method
+
+
+class Bundle:
+    def __init__(self, folder, manifest):
+        self.folder = folder
+        self.version = manifest['version']
+        self.sampled = manifest['sampled']
+        self.domains = manifest['domains']
+        self.presets = manifest['presets']
+        self.pages = manifest['pages']
+        self._keys = {
+            canonical_selection(selection, self.domains): preset for preset, selection in self.presets.items()
+        }
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def preset(self, selection):
+        """Name of the preset equal to ``selection``, or None."""
+        return self._keys.get(canonical_selection(selection, self.domains))
+
+    def engine(self, preset, page, load, figure_cache=figs.figures):
+        """Engine serving ``page`` for ``preset``, with its figures preloaded into ``figure_cache``."""
+        entry = self.pages[preset][page]
+        selection = self.presets[preset]
+        for chart_id, chart in entry['charts'].items():
+            key = cache_key(chart_id, self.version, selection, tuple(chart['params']), self.domains)
+            spec = os.path.join(self.folder, self.version, chart['spec'])
+            figure_cache.get_or_compute(key, lambda spec=spec: open(spec).read())
+        with self._lock:
+            if (preset, page) not in self._results:
+                with open(os.path.join(self.folder, self.version, entry['results']), 'rb') as handle:
+                    self._results[preset, page] = pickle.load(handle)
+            results = self._results[preset, page]
+        return SnapshotEngine(results, self.version, self.domains, self.sampled, load)
+
+
+# Process-wide memo: report folder -> (manifest mtime, bundle)
+_bundles = {}
+_bundles_lock = threading.Lock()
+
+
+def load_bundle(path=DATA_PATH, version=None, folder=None):
+    """Bundle exported for ``version`` (default: the current version) of ``path``, or None."""
+    folder = folder or report_dir(path)
+    manifest_path = os.path.join(folder, 'manifest.json')
+    try:
+        mtime = os.stat(manifest_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _bundles_lock:
+        cached = _bundles.get(folder)
+        if cached is None or cached[0] != mtime:
+            with open(manifest_path) as handle:
+                cached = (mtime, Bundle(folder, json.load(handle)))
+            _bundles[folder] = cached
+    bundle = cached[1]
+    return bundle if bundle.version == (version or source_version(path)) else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', nargs='?', default=DATA_PATH)
+    parser.add_argument('--presets', help='JSON file mapping preset names to filter selections')
+    parser.add_argument('--out', help='bundle folder (default: the one the dashboard serves)')
+    parser.add_argument('--workers', type=int, default=max(WORKERS, os.cpu_count() or 1),
+                        help='processes exporting pages in parallel')
+    parser.add_argument('--mode', choices=['memory', 'chunked', 'duckdb'], default='memory')
+    args = parser.parse_args()
+    presets = None
+    if args.presets:
+        with open(args.presets) as handle:
+            presets = json.load(handle)
+    manifest = export(args.path, presets, args.out, args.workers, args.mode)
+    print(f"Exported {len(PAGES)} pages x {len(manifest['presets'])} presets of version {manifest['version']} "
+          f"to {args.out or report_dir(args.path)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""HyperLogLog sketches for approximate distinct counts.
+
+A sketch is a row of ``2**precision`` small registers; sketches of disjoint
+(or overlapping) sets of values merge by taking the elementwise maximum, so
+the cube keeps one per cell and answers any filter selection by merging the
+selected cells. With the default precision the relative error is about 0.8%.
+"""
+import numpy as np
+
+HLL_PRECISION = 14
+
+
+def hll_registers(hashes, groups, n_groups, precision=HLL_PRECISION):
+    """One sketch per group, from 64-bit ``hashes`` whose group ids are ``groups``."""
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    width = 64 - precision
+    bucket = (hashes >> np.uint64(width)).astype(np.intp)
+    rest = hashes & np.uint64((1 << width) - 1)
+    # Position of the leftmost 1-bit in the remaining bits; frexp's exponent is
+    # the bit length, exact because ``rest`` has fewer than 53 bits
+    rank = (width + 1 - np.frexp(rest.astype(np.float64))[1]).astype(np.uint8)
+    registers = np.zeros((n_groups, 1 << precision), dtype=np.uint8)
+    np.maximum.at(registers, (np.asarray(groups, dtype=np.intp), bucket), rank)
+    return registers
+
+
+def hll_merge(registers, groups, n_groups):
+    """Merge the sketches in ``registers`` row-wise into ``n_groups`` sketches."""
+    merged = np.zeros((n_groups, registers.shape[1]), dtype=np.uint8)
+    np.maximum.at(merged, np.asarray(groups, dtype=np.intp), registers)
+    return merged
+
+
+def hll_estimate(registers):
+    """Estimated number of distinct values seen by one sketch."""
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.ldexp(1.0, -registers.astype(np.int64)).sum()
+    zeros = int((registers == 0).sum())
+    if estimate <= 2.5 * m and zeros:
+        # Small-range correction (linear counting)
+        return m * np.log(m / zeros)
+    return float(estimate)
@@ -0,0 +1,247 @@
+"""DuckDB backend for the page aggregations.
+
+``SQLCube`` has the query interface of ``cube.SalesCube`` but answers it
+with SQL over a DuckDB database built from the CSV, pushing the sidebar
+selection down as a WHERE clause. pandas only sees the grouped results and
+the rows a page asks for, so the sales history is never loaded into a frame.
+
+The database is built once per content version into ``.snapshots`` next to
+the CSV (DuckDB reads the file out of core) and is never written again:
+every process attaches it read-only, so any number of processes (app
+replicas, report workers) can share it. Rows appended to the CSV are
+inserted into an in-memory table of the process instead of rebuilding, and
+``sales`` is a view over both. ``duckdb`` is an optional dependency, only
+imported when this backend is used.
+"""
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from cube import MEASURES
+from data_loader import (
+    CATEGORY_COLUMNS, COLUMNS, DATA_PATH, DTYPES, FILTER_COLUMNS, SNAPSHOT_DIR, appended_since, data_version,
+    invoice_hashes, register_invoices, remove_stale_snapshots,
+)
+from filter_index import RowSelection
+
+SQL_TYPES = {'object': 'VARCHAR', 'category': 'VARCHAR', 'float64': 'DOUBLE', 'int64': 'BIGINT'}
+
+# SQL of the cube's derived dimensions, matching ``cube.time_keys`` and ``rating_bin``
+DIMENSIONS = {
+    'day': "datediff('day', DATE '1970-01-01', \"Date\")",
+    'week': "datediff('day', DATE '1970-01-01', date_trunc('week', \"Date\"))",
+    'month': "(year(\"Date\") - 1970) * 12 + month(\"Date\") - 1",
+    'hour': "CAST(split_part(\"Time\", ':', 1) AS INTEGER)",
+    'rating_bin': "round(\"Rating\", 1)",
+}
+
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def literal(text):
+    return "'" + text.replace("'", "''") + "'"
+
+
+def where_clause(selection, domains, row_count=None):
+    """SQL WHERE clause and parameters for ``selection``; fully selected columns are skipped.
+
+    ``row_count`` limits the rows to the first that many, in file order.
+    """
+    clauses, params = [], []
+    if row_count is not None:
+        clauses.append(f'_row < {int(row_count)}')
+    for col, values in selection.items():
+        values = list(values)
+        if set(values) >= set(domains[col]):
+            continue
+        if not values:
+            clauses.append('FALSE')
+            continue
+        clauses.append(f"{quote(col)} IN ({', '.join('?' * len(values))})")
+        params.extend(str(value) for value in values)
+    return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+
+def to_frame_types(df):
+    """Query result with the dtypes of a loaded sales frame."""
+    for col in df.columns:
+        if col in CATEGORY_COLUMNS:
+            df[col] = df[col].astype('category')
+        elif col == 'Date':
+            df[col] = pd.to_datetime(df[col])
+    return df
+
+
+class SQLCube:
+    def __init__(self, connection, version=None):
+        self.connection = connection
+        self.version = version
+        self.domains = {
+            col: list(self.execute(f'SELECT DISTINCT {quote(col)} FROM sales ORDER BY 1')[col])
+            for col in FILTER_COLUMNS
+        }
+        # Appends insert into the same view, so queries are bounded to the rows of this version
+        self.row_count = int(self.execute('SELECT count(*) AS n FROM sales')['n'].iloc[0])
+
+    def where(self, selection):
+        return where_clause(selection, self.domains, self.row_count)
+
+    def execute(self, sql, params=()):
+        # A cursor per query, since sessions query from their own threads
+        with self.connection.cursor() as cursor:
+            return cursor.execute(sql, list(params)).df()
+
+    def query(self, selection, by=()):
+        """Sums of the measures and row ``count`` per ``by``, like ``SalesCube.query``."""
+        by = list(by)
+        keys = [f'{DIMENSIONS.get(col, quote(col))} AS {quote(col)}' for col in by]
+        sums = [
+            f"CAST(sum({quote(col)}) AS {'BIGINT' if col == 'Quantity' else 'DOUBLE'}) AS {quote(col)}"
+            for col in MEASURES
+        ]
+        clause, params = self.where(selection)
+        sql = f"SELECT {', '.join(keys + sums)}, count(*) AS count FROM sales{clause}"
+        if not by:
+            return self.execute(sql, params).iloc[0].fillna(0)
+        sql += f" GROUP BY ALL ORDER BY {', '.join(quote(col) for col in by)}"
+        return to_frame_types(self.execute(sql, params)).set_index(by)
+
+    def distinct_invoices(self, selection):
+        """Number of distinct Invoice IDs matching ``selection``.
+
+        Exact: DuckDB counts distinct values out of core, and its own
+        ``approx_count_distinct`` sketch is far coarser than the cube's.
+        """
+        clause, params = self.where(selection)
+        return float(self.execute(f'SELECT count(DISTINCT "Invoice ID") AS n FROM sales{clause}', params)['n'][0])
+
+    def rows(self, selection):
+        return SQLRowSelection(self, selection)
+
+
+class SQLRowSelection:
+    """``filter_index.RowSelection`` counterpart whose rows are fetched from the database on demand."""
+
+    def __init__(self, cube, selection):
+        self.cube = cube
+        self.clause, self.params = cube.where(selection)
+        self._len = None
+
+    def _select(self, columns, suffix=''):
+        names = ', '.join(quote(col) for col in (columns or COLUMNS))
+        sql = f'SELECT {names} FROM sales{self.clause} ORDER BY _row{suffix}'
+        return to_frame_types(self.cube.execute(sql, self.params))
+
+    def __len__(self):
+        if self._len is None:
+            self._len = int(self.cube.execute(f'SELECT count(*) AS n FROM sales{self.clause}', self.params)['n'][0])
+        return self._len
+
+    def __getitem__(self, col):
+        return self._select([col])[col]
+
+    def frame(self, columns=None):
+        return self._select(columns)
+
+    def head(self, n=5):
+        return self._select(None, f' LIMIT {int(n)}')
+
+    def subset(self, local):
+        """The rows at positions ``local`` within this selection, fetched as a frame."""
+        local = np.asarray(local, dtype=np.int64)
+        picked = pd.DataFrame({'_pos': local, '_order': np.arange(len(local))})
+        names = ', '.join(quote(col) for col in COLUMNS)
+        sql = (f'SELECT {names} FROM (SELECT *, row_number() OVER (ORDER BY _row) - 1 AS _pos '
+               f'FROM sales{self.clause}) AS selected JOIN picked USING (_pos) ORDER BY _order')
+        with self.cube.connection.cursor() as cursor:
+            cursor.register('picked', picked)
+            return RowSelection(to_frame_types(cursor.execute(sql, self.params).df()))
+
+
+def database_path(path, digest):
+    folder = os.path.join(os.path.dirname(path), SNAPSHOT_DIR)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(folder, f'{stem}-{digest}.duckdb')
+
+
+def build_database(path, digest):
+    """Load ``path`` into a DuckDB database file and drop databases of older versions."""
+    import duckdb
+
+    target = database_path(path, digest)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    types = ', '.join(f'{literal(col)}: {literal(SQL_TYPES[DTYPES[col]] if col in DTYPES else "DATE")}'
+                      for col in COLUMNS)
+    tmp = f'{target}.{os.getpid()}.tmp'
+    with duckdb.connect(tmp) as connection:
+        connection.execute(
+            f"CREATE TABLE sales AS SELECT * FROM read_csv({literal(path)}, header = true, delim = ',', quote = '\"', "
+            f"dateformat = '%m/%d/%Y', columns = {{{types}}})"
+        )
+        connection.execute('CREATE TABLE meta AS SELECT ? AS version', [digest])
+    os.replace(tmp, target)
+    remove_stale_snapshots(path, target)
+    return target
+
+
+def open_database(path, digest):
+    """In-memory connection over the database of version ``digest`` of ``path``, built if missing.
+
+    The database file is attached read-only. ``sales`` is a view of its rows
+    followed by those of the in-memory ``appended`` table, with ``_row``
+    numbering them in file order.
+    """
+    import duckdb
+
+    target = database_path(path, digest)
+    connection = duckdb.connect()
+    try:
+        connection.execute(f'ATTACH {literal(target)} AS stored (READ_ONLY)')
+        current = connection.execute('SELECT version FROM stored.meta').fetchone()[0] == digest
+    except duckdb.Error:
+        current = False
+    if not current:
+        # Missing, or left over from an interrupted or older build
+        connection.close()
+        connection = duckdb.connect()
+        connection.execute(f'ATTACH {literal(build_database(path, digest))} AS stored (READ_ONLY)')
+    stored_rows = connection.execute('SELECT count(*) FROM stored.sales').fetchone()[0]
+    connection.execute('CREATE TABLE appended AS SELECT * FROM stored.sales LIMIT 0')
+    connection.execute(
+        'CREATE VIEW sales AS SELECT *, rowid AS _row FROM stored.sales '
+        f'UNION ALL SELECT *, rowid + {int(stored_rows)} AS _row FROM appended'
+    )
+    return connection
+
+
+# Process-wide memo: path -> SQLCube of the current file version
+_cubes = {}
+_cubes_lock = threading.Lock()
+
+
+def load_sql_cube(path=DATA_PATH):
+    """``SQLCube`` of the current version of ``path``; appended rows are inserted in memory, not rebuilt."""
+    path = os.path.abspath(path)
+    with _cubes_lock:
+        version = data_version(path)
+        cube = _cubes.get(path)
+        if cube is not None and cube.version != version:
+            rows = appended_since(path, cube.version, until=version)
+            if rows is None:
+                cube = None
+            else:
+                with cube.connection.cursor() as cursor:
+                    cursor.register('new_rows', rows[COLUMNS])
+                    cursor.execute('INSERT INTO appended SELECT * FROM new_rows')
+                cube = SQLCube(cube.connection, version)
+        if cube is None:
+            cube = SQLCube(open_database(path, version), version)
+            # Lets data_version() recognise later appends to the file
+            ids = cube.execute('SELECT "Invoice ID" FROM sales')['Invoice ID']
+            register_invoices(path, version, invoice_hashes(ids))
+        _cubes[path] = cube
+        return cube
@@ -0,0 +1,304 @@
+"""Chunked ingestion of sales exports that do not fit in memory.
+
+The CSV is read in chunks; every chunk is folded into the aggregate cube
+(sums, counts and rating distributions by the filter columns and the page
+dimensions) and into a bounded uniform sample of rows used for the row-level
+views. Raw rows are never held all at once.
+
+With more than one worker (``DASHBOARD_WORKERS``) the file is split into
+newline-aligned byte ranges that are aggregated in a process pool; the
+partial cubes, samples and Invoice ID hashes are merged afterwards.
+
+Run ``python streaming.py [path] [--chunksize N] [--workers 1 2 4]`` to
+report throughput and peak memory for a file at each worker count.
+"""
+import argparse
+import io
+import os
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from cube import build_cube, merge_cubes
+from data_loader import (
+    CATEGORY_COLUMNS, COLUMNS, DATA_PATH, DATE_FORMAT, DTYPES, appended_since, data_version, invoice_hashes,
+    register_invoices,
+)
+from filter_index import FilterIndex
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS in the ingestion stats
+    resource = None
+
+DEFAULT_CHUNKSIZE = 100_000
+SAMPLE_ROWS = 20_000
+# Processes aggregating byte ranges of the file in parallel (1 = in-process)
+WORKERS = int(os.environ.get('DASHBOARD_WORKERS', 1))
+
+
+class IngestStats:
+    def __init__(self, rows, chunks, seconds, peak_traced_bytes, max_rss_bytes):
+        self.rows = rows
+        self.chunks = chunks
+        self.seconds = seconds
+        self.peak_traced_bytes = peak_traced_bytes
+        self.max_rss_bytes = max_rss_bytes
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.seconds if self.seconds else float('inf')
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'chunks': self.chunks,
+            'seconds': round(self.seconds, 3),
+            'rows_per_sec': round(self.rows_per_sec),
+            'peak_traced_bytes': self.peak_traced_bytes,
+            'max_rss_bytes': self.max_rss_bytes,
+        }
+
+    def __str__(self):
+        peak = 'n/a' if self.peak_traced_bytes is None else f'{self.peak_traced_bytes / 2**20:,.1f} MiB'
+        max_rss = 'n/a' if self.max_rss_bytes is None else f'{self.max_rss_bytes / 2**20:,.1f} MiB'
+        return (f'{self.rows:,} rows in {self.chunks} chunks, {self.seconds:.2f}s '
+                f'({self.rows_per_sec:,.0f} rows/s), peak traced memory {peak}, '
+                f'max RSS {max_rss}')
+
+
+class StreamedSales:
+    """Aggregates and row sample produced by a chunked ingestion."""
+
+    def __init__(self, cube, sample, sample_keys, sample_rows=SAMPLE_ROWS, version=None, stats=None):
+        self.cube = cube
+        self.sample = sample
+        self.sample_keys = sample_keys
+        self.sample_rows = sample_rows
+        self.version = version
+        self.stats = stats
+        self._index = None
+
+    def appended(self, rows, version):
+        """Fold rows appended to the file into a new ``StreamedSales``."""
+        rng = np.random.default_rng([self.cube.tables[()]['count'].sum(), len(rows)])
+        sample = fold_sample(self.sample.assign(_key=self.sample_keys), rows, self.sample_rows, rng)
+        cube = merge_cubes([self.cube, build_cube(rows)], version)
+        return StreamedSales(cube, *finish_sample(sample), self.sample_rows, version, self.stats)
+
+    @property
+    def index(self):
+        """Filter index over the sample rows."""
+        if self._index is None:
+            self._index = FilterIndex(self.sample, version=self.version)
+        return self._index
+
+
+class ByteRange(io.RawIOBase):
+    """Read-only view of bytes ``start:end`` of a file."""
+
+    def __init__(self, path, start, end):
+        self._handle = open(path, 'rb')
+        self._handle.seek(start)
+        self._left = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self._left)
+        if size <= 0:
+            return 0
+        read = self._handle.readinto(memoryview(buffer)[:size])
+        self._left -= read
+        return read
+
+    def close(self):
+        self._handle.close()
+        super().close()
+
+
+def byte_ranges(path, parts):
+    """Split the rows of ``path`` into up to ``parts`` byte ranges ending on line breaks.
+
+    Rows are assumed not to contain quoted line breaks, which the export never has.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as handle:
+        handle.readline()
+        bounds = [handle.tell()]
+        for part in range(1, parts):
+            handle.seek(max(bounds[-1], bounds[0] + (size - bounds[0]) * part // parts))
+            handle.readline()
+            bounds.append(min(handle.tell(), size))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def read_chunks(path, chunksize=DEFAULT_CHUNKSIZE, byte_range=None):
+    """Yield parsed chunks of ``path``, indexed by their row number in the file.
+
+    With ``byte_range`` only the (header-less) rows in that range are read and
+    numbered from 0.
+    """
+    if byte_range is None:
+        source, header = path, {}
+    else:
+        source, header = io.BufferedReader(ByteRange(path, *byte_range)), {'header': None, 'names': COLUMNS}
+    offset = 0
+    with pd.read_csv(source, dtype=DTYPES, chunksize=chunksize, **header) as reader:
+        for chunk in reader:
+            chunk['Date'] = pd.to_datetime(chunk['Date'], format=DATE_FORMAT)
+            chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+            offset += len(chunk)
+            yield chunk
+    if byte_range is not None:
+        source.close()
+
+
+def fold_chunks(chunks, sample_rows, rng):
+    """Cube, keyed row sample, Invoice ID hashes and row/chunk counts of ``chunks``."""
+    cube = None
+    sample = None
+    invoices = []
+    rows = count = 0
+    for chunk in chunks:
+        part = build_cube(chunk)
+        cube = part if cube is None else merge_cubes([cube, part])
+        sample = fold_sample(sample, chunk, sample_rows, rng)
+        invoices.append(invoice_hashes(chunk['Invoice ID']))
+        rows += len(chunk)
+        count += 1
+    return cube, sample, np.concatenate(invoices), rows, count
+
+
+def _fold_range(path, byte_range, chunksize, sample_rows, seed):
+    # Module-level so that the process pool can pickle it
+    return fold_chunks(read_chunks(path, chunksize, byte_range), sample_rows, np.random.default_rng(seed))
+
+
+def fold_parallel(path, workers, chunksize, sample_rows, seed):
+    """``fold_chunks`` over byte ranges of ``path`` in ``workers`` processes, merged."""
+    ranges = byte_ranges(path, workers)
+    with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+        parts = list(pool.map(
+            _fold_range, [path] * len(ranges), ranges, [chunksize] * len(ranges),
+            [sample_rows] * len(ranges), [[seed, part] for part in range(len(ranges))],
+        ))
+    samples = []
+    offset = 0
+    for _, sample, _, rows, _ in parts:
+        # Renumber each range's rows after the rows of the ranges before it
+        samples.append(sample.set_axis(sample.index + offset))
+        offset += rows
+    sample = pd.concat(samples)
+    if len(sample) > sample_rows:
+        sample = sample.nsmallest(sample_rows, '_key')
+    return (
+        merge_cubes([part[0] for part in parts]),
+        sample,
+        np.concatenate([part[2] for part in parts]),
+        offset,
+        sum(part[4] for part in parts),
+    )
+
+
+def fold_sample(sample, chunk, size, rng):
+    """Keep the ``size`` rows with the smallest random keys seen so far.
+
+    Every row gets an independent uniform key, so the kept rows are a uniform
+    sample without replacement of everything folded in.
+    """
+    chunk = chunk.assign(_key=rng.random(len(chunk)))
+    combined = chunk if sample is None else pd.concat([sample, chunk])
+    if len(combined) > size:
+        combined = combined.nsmallest(size, '_key')
+    return combined
+
+
+def finish_sample(sample):
+    """Folded sample in file order with category dtypes restored, and its keys."""
+    sample = sample.sort_index()
+    keys = sample.pop('_key').to_numpy()
+    for col in CATEGORY_COLUMNS:
+        sample[col] = sample[col].astype('category')
+    return sample, keys
+
+
+def ingest(path=DATA_PATH, chunksize=DEFAULT_CHUNKSIZE, sample_rows=SAMPLE_ROWS, track_memory=False, seed=42,
+           workers=WORKERS):
+    """Fold ``path`` chunk by chunk into a cube and a row sample.
+
+    With ``track_memory`` the peak of Python-tracked allocations (pandas and
+    numpy buffers included) is recorded; it slows ingestion down noticeably
+    and only covers this process, so it is not recorded for ``workers > 1``.
+    """
+    version = data_version(path)
+    track_memory = track_memory and workers <= 1
+    if track_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        if workers > 1:
+            cube, sample, invoices, rows, chunks = fold_parallel(path, workers, chunksize, sample_rows, seed)
+        else:
+            rng = np.random.default_rng(seed)
+            cube, sample, invoices, rows, chunks = fold_chunks(read_chunks(path, chunksize), sample_rows, rng)
+        peak = tracemalloc.get_traced_memory()[1] if track_memory else None
+    finally:
+        if track_memory:
+            tracemalloc.stop()
+    seconds = time.perf_counter() - start
+    # ru_maxrss is reported in KiB on Linux; children covers the largest worker
+    max_rss = None if resource is None else max(
+        resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)
+    ) * 1024
+    stats = IngestStats(rows, chunks, seconds, peak, max_rss)
+    # Lets data_version() recognise later appends to the file
+    register_invoices(path, version, invoices)
+    cube.version = version
+    return StreamedSales(cube, *finish_sample(sample), sample_rows, version, stats)
+
+
+# Process-wide memo: path -> ingestion of the current file version
+_streamed = {}
+_streamed_lock = threading.Lock()
+
+
+def load_streamed(path=DATA_PATH, chunksize=DEFAULT_CHUNKSIZE, workers=WORKERS):
+    """Ingestion of the current version of ``path``; appended rows are folded in."""
+    path = os.path.abspath(path)
+    with _streamed_lock:
+        version = data_version(path)
+        streamed = _streamed.get(path)
+        if streamed is not None and streamed.version != version:
+            rows = appended_since(path, streamed.version, until=version)
+            streamed = None if rows is None else streamed.appended(rows, version)
+        if streamed is None:
+            streamed = ingest(path, chunksize, workers=workers)
+        _streamed[path] = streamed
+        return streamed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', nargs='?', default=DATA_PATH)
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument('--sample-rows', type=int, default=SAMPLE_ROWS)
+    parser.add_argument('--workers', type=int, nargs='+', default=[WORKERS],
+                        help='worker counts to ingest with, e.g. 1 2 4 8 to measure scaling')
+    args = parser.parse_args()
+    baseline = None
+    for workers in args.workers:
+        streamed = ingest(args.path, args.chunksize, args.sample_rows, track_memory=True, workers=workers)
+        baseline = baseline or streamed.stats.seconds
+        print(f'{workers} worker(s): {streamed.stats} ({baseline / streamed.stats.seconds:.2f}x)')
+    print(f'{streamed.cube.cell_count:,} cube cells, {len(streamed.sample):,} sampled rows')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from filter_index import FilterIndex, RowSelection, append_bits
+
+VALUES = {
+    'Branch': ['A', 'B', 'C'],
+    'City': ['Yangon', 'Mandalay', 'Naypyitaw'],
+    'Customer type': ['Member', 'Normal'],
+    'Gender': ['Female', 'Male'],
+}
+
+
+def sales(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        col: pd.Categorical(rng.choice(values, rows), categories=values) for col, values in VALUES.items()
+    })
+
+
+def expected_rows(df, selection):
+    mask = np.ones(len(df), dtype=bool)
+    for col, values in selection.items():
+        mask &= df[col].isin(values).to_numpy()
+    return np.flatnonzero(mask)
+
+
+def selected_rows(index, selection):
+    rows = index.select(selection)
+    return np.arange(index.n_rows) if rows is None else rows
+
+
+SELECTIONS = {
+    'all': dict(VALUES),
+    'one value': {**VALUES, 'Branch': ['B']},
+    'complement': {**VALUES, 'Branch': ['A', 'C'], 'City': ['Mandalay', 'Naypyitaw']},
+    'several columns': {**VALUES, 'Branch': ['A'], 'Customer type': ['Member'], 'Gender': ['Female']},
+    'empty': {**VALUES, 'Gender': []},
+    'partial': {'City': ['Yangon']},
+    'unknown value': {**VALUES, 'Branch': ['A', 'Z']},
+}
+
+
+@pytest.mark.parametrize('rows', [0, 1, 13, 64, 1001])
+@pytest.mark.parametrize('name', SELECTIONS)
+def test_select_matches_isin(rows, name):
+    df = sales(rows)
+    index = FilterIndex(df)
+    assert np.array_equal(selected_rows(index, SELECTIONS[name]), expected_rows(df, SELECTIONS[name]))
+
+
+def test_select_all_returns_none():
+    index = FilterIndex(sales(100))
+    assert index.select(VALUES) is None
+    assert index.select({}) is None
+
+
+def test_select_empty_returns_no_rows():
+    index = FilterIndex(sales(100))
+    rows = index.select({**VALUES, 'Gender': []})
+    assert rows is not None and len(rows) == 0
+
+
+def test_select_ignores_unindexed_columns():
+    index = FilterIndex(sales(50), columns=['Branch'])
+    assert index.select({'Gender': ['Male']}) is None
+
+
+def test_select_object_columns():
+    df = sales(200).astype(object)
+    index = FilterIndex(df)
+    selection = SELECTIONS['several columns']
+    assert np.array_equal(selected_rows(index, selection), expected_rows(df, selection))
+
+
+@pytest.mark.parametrize('n_bits, extra', [(0, 5), (3, 1), (7, 9), (8, 8), (13, 21), (16, 0), (21, 3)])
+def test_append_bits(n_bits, extra):
+    rng = np.random.default_rng(n_bits * 31 + extra)
+    old, new = rng.random(n_bits) < 0.5, rng.random(extra) < 0.5
+    packed = append_bits(np.packbits(old), n_bits, new)
+    assert np.array_equal(np.unpackbits(packed, count=n_bits + extra).astype(bool), np.concatenate([old, new]))
+    assert len(packed) == (n_bits + extra + 7) // 8
+
+
+@pytest.mark.parametrize('before, after', [(0, 7), (5, 3), (13, 11), (16, 8), (999, 2)])
+def test_appended_matches_rebuilt_index(before, after):
+    head, rows = sales(before, seed=before), sales(after, seed=before + 1)
+    # Appended rows may bring values the first rows never had
+    head = head[head['Branch'] != 'C'].reset_index(drop=True)
+    head['Branch'] = head['Branch'].cat.remove_unused_categories()
+    if after:
+        rows.loc[after - 1, 'Branch'] = 'C'
+    df = pd.concat([head.astype(object), rows.astype(object)], ignore_index=True)
+    index = FilterIndex(head).appended(rows, version='v2')
+    assert index.n_rows == len(df)
+    assert index.version == 'v2'
+    for selection in SELECTIONS.values():
+        assert np.array_equal(selected_rows(index, selection), expected_rows(df, selection))
+
+
+def test_row_selection_views_the_selected_rows():
+    df = sales(40).assign(Total=np.arange(40.0))
+    index = FilterIndex(df)
+    rows = RowSelection(df, index.select(SELECTIONS['one value']))
+    expected = df[df['Branch'] == 'B']
+    assert len(rows) == len(expected)
+    assert np.array_equal(rows['Total'].to_numpy(), expected['Total'].to_numpy())
+    assert rows.head(3).equals(expected.head(3))
+    assert np.array_equal(rows.subset([1, 0])['Total'].to_numpy(), expected['Total'].to_numpy()[[1, 0]])
@@ -0,0 +1,130 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('duckdb')
+
+from aggregations import LRUCache
+from benchmark import AGGREGATIONS, synthetic_sales, write_export
+from data_loader import read_sales_csv
+from engine import PAGE_AGGREGATIONS, SalesEngine
+from sql_backend import database_path, load_sql_cube
+
+ROWS = 5000
+SPECS = list(dict.fromkeys(AGGREGATIONS + [spec for page in PAGE_AGGREGATIONS.values() for spec in page]))
+SELECTIONS = {
+    'all': {},
+    'subset': {'Branch': ['A', 'B'], 'Gender': ['Female']},
+    'single': {'City': ['Mandalay'], 'Customer type': ['Member']},
+    'empty': {'Gender': []},
+}
+
+
+def same_result(left, right, rtol):
+    """Whether two aggregation results agree up to ``rtol``, labels included (row selections by their rows)."""
+    if hasattr(left, 'frame'):
+        left, right = left.frame(), right.frame()
+    if isinstance(left, dict):
+        return left.keys() == right.keys() and all(same_result(left[key], right[key], rtol) for key in left)
+    if isinstance(left, (pd.DataFrame, pd.Series)):
+        assert_equal = pd.testing.assert_frame_equal if isinstance(left, pd.DataFrame) else pd.testing.assert_series_equal
+        try:
+            assert_equal(left, right, check_dtype=False, check_categorical=False, check_index_type=False,
+                         check_names=False, rtol=rtol)
+        except (AssertionError, TypeError):
+            return False
+        return True
+    if isinstance(left, str):
+        return left == right
+    left, right = np.asarray(left), np.asarray(right)
+    return left.shape == right.shape and bool(np.allclose(left, right, rtol=rtol))
+
+
+# Specs returning raw rows, labelled by their position in the frame of each engine
+ROW_SPECS = {'rows', 'sample_rows', 'scatter_sample'}
+
+
+def outcome(engine, spec, selection):
+    """Result of ``spec`` on ``engine``; an exception fails the test."""
+    result = getattr(engine, spec[0])(selection, *spec[1:])
+    if spec[0] in ROW_SPECS:
+        result = (result.frame() if hasattr(result, 'frame') else result).reset_index(drop=True)
+    return result
+
+
+def fresh_engines(path):
+    # Both engines start from the CSV, so they see the same parsed values
+    expected = SalesEngine.from_frame(
+        read_sales_csv(path), cache=LRUCache(maxsize=None), positions=LRUCache(maxsize=None)
+    )
+    actual = SalesEngine.from_sql(path, cache=LRUCache(maxsize=None))
+    return expected, actual
+
+
+@pytest.fixture(scope='module')
+def export(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('sql') / 'sales.csv')
+    write_export(synthetic_sales(ROWS), path)
+    return path
+
+
+@pytest.fixture(scope='module')
+def engines(export):
+    return fresh_engines(export)
+
+
+@pytest.mark.parametrize('spec', SPECS, ids=lambda spec: '.'.join(map(str, spec)))
+@pytest.mark.parametrize('name', SELECTIONS)
+def test_parity_with_pandas_engine(engines, name, spec):
+    expected, actual = engines
+    selection = {**expected.default_selection(), **SELECTIONS[name]}
+    # The cube's distinct count is a HyperLogLog estimate, DuckDB's is exact
+    rtol = 0.05 if spec[0] == 'customer_count' and spec[1:] != (True,) else 1e-9
+    assert same_result(outcome(expected, spec, selection), outcome(actual, spec, selection), rtol)
+
+
+def test_appended_rows_keep_parity_and_older_snapshots(tmp_path):
+    path = str(tmp_path / 'sales.csv')
+    sales = synthetic_sales(300)
+    write_export(sales.iloc[:200], path)
+    before = SalesEngine.from_sql(path, cache=LRUCache(maxsize=None))
+    extra = str(tmp_path / 'extra.csv')
+    write_export(sales.iloc[200:], extra)
+    with open(extra, 'rb') as handle:
+        rows = handle.read().split(b'\n', 1)[1]
+    with open(path, 'ab') as handle:
+        handle.write(rows)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    cube = load_sql_cube(path)
+    # Appends are folded in memory: the stored database is not rebuilt
+    assert cube.connection is before.cube.connection
+    assert cube.row_count == 300 and before.row_count == 200
+    expected, actual = fresh_engines(path)
+    selection = expected.default_selection()
+    for spec in SPECS:
+        rtol = 0.05 if spec[0] == 'customer_count' and spec[1:] != (True,) else 1e-9
+        assert same_result(outcome(expected, spec, selection), outcome(actual, spec, selection), rtol), spec
+    assert before.kpis(selection)['invoices'] == 200
+
+
+def test_database_is_shared_read_only_across_processes(export, engines):
+    assert os.path.exists(database_path(os.path.abspath(export), engines[1].version))
+    script = (
+        'import sys; sys.path[:0] = sys.argv[2:]\n'
+        'from engine import SalesEngine\n'
+        'engine = SalesEngine.from_sql(sys.argv[1])\n'
+        'print(engine.kpis(engine.default_selection())["invoices"])\n'
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = [sys.executable, '-c', script, export, root, *sys.path]
+    # Several processes hold the database open at once, this one included
+    workers = [subprocess.Popen(command, stdout=subprocess.PIPE, text=True) for _ in range(3)]
+    for worker in workers:
+        out, _ = worker.communicate(timeout=120)
+        assert worker.returncode == 0
+        assert int(out) == ROWS